@@ -0,0 +1,187 @@
+# Describes a whole collection of sketches in one go, e.g. an archive of scraped projects.
+# Output is HTML by default, or one of the serialization formats.
+# The core parts bin is loaded once and shared with the worker processes by fork.
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from fritzing_parser import GENERATED_PART_CACHE, PartsBin, load_core_parts, parse_sketch
+from result_cache import ResultCache, describe_sketch_cached
+import instrumentation
+import serialization
+
+SKETCH_EXTENSION = '.fzz'
+
+# Loaded in the parent before the pool starts so the workers inherit them
+core_parts_bin: Optional[PartsBin] = None
+result_cache: Optional[ResultCache] = None
+output_format = 'html'
+
+
+def find_sketches(source: str) -> List[str]:
+    """
+    Expands a directory (searched recursively), a glob pattern, or a manifest file with
+    one sketch path per line into a list of sketch paths.
+    """
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '**', '*' + SKETCH_EXTENSION), recursive=True))
+
+    if glob.has_magic(source):
+        return sorted(glob.glob(source, recursive=True))
+
+    if source.endswith(SKETCH_EXTENSION):
+        return [source]
+
+    # Anything else is a manifest. Relative paths are relative to the manifest.
+    manifest_dir = os.path.dirname(source)
+    with open(source, 'r') as fh:
+        return [
+            os.path.join(manifest_dir, line.strip())
+            for line in fh
+            if line.strip() and not line.startswith('#')
+        ]
+
+
+def output_names(sketch_paths: List[str], extension: str) -> Dict[str, str]:
+    """ Picks an output file name for each sketch, disambiguating sketches with the same name """
+    def stem(path: str) -> str:
+        return os.path.splitext(os.path.basename(path))[0]
+
+    stem_counts = Counter(stem(p) for p in sketch_paths)
+
+    names = {}
+    for path in sketch_paths:
+        name = stem(path)
+        if stem_counts[name] > 1:
+            name += '-' + hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+        names[path] = name + '.' + extension
+
+    return names
+
+
+def describe_sketch(sketch_path: str, out_path: str) -> dict:
+    """ Runs in a worker. Errors are reported in the result rather than raised. """
+    start = time.perf_counter()
+    result = {'sketch': sketch_path, 'pid': os.getpid()}
+
+    try:
+        with instrumentation.trace_sketch(sketch_path):
+            if output_format == 'html':
+                output = describe_sketch_cached(result_cache, core_parts_bin, sketch_path).encode('utf-8')
+            else:
+                output = serialization.dump(parse_sketch(core_parts_bin, sketch_path), output_format)
+
+        with open(out_path, 'wb') as fh:
+            fh.write(output)
+
+        result.update(ok=True, output=out_path)
+    except Exception as e:
+        result.update(ok=False, error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+
+    result['seconds'] = time.perf_counter() - start
+    result['part_cache'] = GENERATED_PART_CACHE.stats()  # Cumulative for this worker
+    return result
+
+
+def run_batch(sketch_paths: List[str], out_dir: str, workers: int) -> List[dict]:
+    os.makedirs(out_dir, exist_ok=True)
+    names = output_names(sketch_paths, output_format)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+        futures = {
+            executor.submit(describe_sketch, path, os.path.join(out_dir, names[path])): path
+            for path in sketch_paths
+        }
+
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:  # e.g. a worker died
+                result = {'sketch': futures[future], 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+            if result['ok']:
+                print(f"ok     {result['sketch']}", file=sys.stderr)
+            else:
+                print(f"FAILED {result['sketch']}: {result['error']}", file=sys.stderr)
+
+            results.append(result)
+
+    results.sort(key=lambda r: r['sketch'])
+    return results
+
+
+def summarize(results: List[dict]) -> dict:
+    # Each worker reports its own running totals, so take the latest from each one
+    latest_cache_stats: Dict[int, dict] = {}
+    for r in results:
+        if 'part_cache' in r:
+            stats = latest_cache_stats.get(r['pid'])
+            if stats is None or r['part_cache']['hits'] + r['part_cache']['misses'] > stats['hits'] + stats['misses']:
+                latest_cache_stats[r['pid']] = r['part_cache']
+
+    return {
+        'succeeded': sum(1 for r in results if r['ok']),
+        'failed': sum(1 for r in results if not r['ok']),
+        'part_cache': {
+            'hits': sum(s['hits'] for s in latest_cache_stats.values()),
+            'misses': sum(s['misses'] for s in latest_cache_stats.values()),
+        },
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Describe many Fritzing sketches')
+    arg_parser.add_argument(
+        'sources',
+        nargs='+',
+        help='Directories, glob patterns, .fzz files, or manifest files listing one .fzz path per line',
+    )
+    arg_parser.add_argument('--out-dir', required=True, help='Directory to write the output files to')
+    arg_parser.add_argument('--format', choices=['html'] + serialization.FORMATS, default='html')
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    arg_parser.add_argument('--report', help='Where to write the JSON report (default: OUT_DIR/report.json)')
+    arg_parser.add_argument(
+        '--rebuild-parts-cache',
+        action='store_true',
+        help='Reparse every core part file instead of reusing the on-disk parts cache',
+    )
+    arg_parser.add_argument(
+        '--result-cache',
+        metavar='DIR',
+        help='Reuse descriptions of previously seen sketches stored in this directory (HTML only)',
+    )
+    instrumentation.add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    # The workers inherit this; each writes its own records
+    instrumentation.configure_from_args(args)
+
+    sketch_paths = [p for source in args.sources for p in find_sketches(source)]
+
+    output_format = args.format
+    core_parts_bin = load_core_parts(rebuild_cache=args.rebuild_parts_cache, workers=args.workers)
+    if args.result_cache:
+        result_cache = ResultCache(args.result_cache)
+
+    summary = summarize(run_batch(sketch_paths, args.out_dir, args.workers))
+
+    report_path = args.report or os.path.join(args.out_dir, 'report.json')
+    with open(report_path, 'w') as fh:
+        json.dump(summary, fh, indent=2)
+
+    print(
+        f"{summary['succeeded']} succeeded, {summary['failed']} failed; report written to {report_path}",
+        file=sys.stderr,
+    )
+    sys.exit(1 if summary['failed'] else 0)
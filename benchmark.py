@@ -0,0 +1,683 @@
+# Rough timings for the slow parts of the pipeline, so changes to them can be compared
+import argparse
+import dataclasses
+import http.server
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Set, Tuple
+from zipfile import ZipFile
+
+import jinja2
+
+from models import *
+
+from describer import TEMPLATE_DIR, TEMPLATE_NAME, collect_parts, describe_as_html, nl2br, render_row
+from fritzing_parser import (
+    FACTORY_PART_LONG_DESCRIPTION_OVERRIDES,
+    FACTORY_PART_MODULE_ID_SUFFIXES,
+    FACTORY_PART_TITLE_OVERRIDES,
+    FzPart,
+    InstanceRecord,
+    PartsBin,
+    PinRef,
+    SuffixMatcher,
+    TEMPLATED_PART_FAMILIES,
+    TEMPLATED_PARTS,
+    TemplatedPartMatcher,
+    build_nets,
+    build_schematic,
+    find_sketch_files,
+    iter_instances,
+    load_core_parts,
+    parse_part_file,
+    parse_sketch,
+    read_instance,
+    sort_adj,
+)
+from synthetic import SketchSpec, project_page_html, write_core_parts, write_sketch
+
+
+def best_time(fn: Callable[[], object], repeat: int) -> float:
+    """ Returns the fastest of `repeat` runs of fn, in seconds """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def synthetic_core_dir(args) -> str:
+    """ Writes --core-parts synthetic part files to the fixture dir and returns their directory """
+    fixture_dir = args.fixture_dir or tempfile.mkdtemp(prefix='circuit-describer-bench-')
+    core_dir = os.path.join(fixture_dir, 'core')
+    write_core_parts(core_dir, args.core_parts)
+    return core_dir
+
+
+def write_synthetic_sketch(fixture_dir: str, size: int, core_parts: int) -> str:
+    """ Writes a synthetic sketch with size parts and twice as many wires; returns its path """
+    spec = SketchSpec(
+        parts=size,
+        wires=2 * size,
+        net_labels=max(2, size // 10),
+        grounds=max(1, size // 20),
+        core_parts=core_parts,
+        seed=size,
+    )
+    path = os.path.join(fixture_dir, f"synthetic_{size}.fzz")
+    write_sketch(path, spec)
+    return path
+
+
+def bench_parts_load(args) -> dict:
+    dirs = args.parts_dir or [synthetic_core_dir(args)]
+
+    # The cache is disabled so both of these measure a cold load
+    serial = best_time(lambda: load_core_parts(cache_path=None, dirs=dirs), args.repeat)
+    parallel = best_time(lambda: load_core_parts(cache_path=None, workers=args.workers, dirs=dirs), args.repeat)
+
+    return {
+        'part_count': len(load_core_parts(cache_path=None, dirs=dirs)),
+        'workers': args.workers,
+        'serial_s': serial,
+        'parallel_s': parallel,
+        'speedup': serial / parallel,
+    }
+
+
+def random_adjacencies(connection_count: int, seed: int = 0) -> Set[Tuple[PinRef, PinRef]]:
+    """ Random connections between 2-8 pin parts, roughly shaped like a real sketch """
+    rng = random.Random(seed)
+    part_count = max(2, connection_count // 2)
+    pin_counts = [rng.randint(2, 8) for _ in range(part_count)]
+
+    def random_pin() -> PinRef:
+        part = rng.randrange(part_count)
+        return PinRef(part_instance_id=str(part), pin_id=f"connector{rng.randrange(pin_counts[part])}")
+
+    return {sort_adj(random_pin(), random_pin()) for _ in range(connection_count)}
+
+
+def quadratic_build_nets(adjacencies: Set[Tuple[PinRef, PinRef]]) -> List[List[PinRef]]:
+    """ The pairwise merging loop build_nets replaced, kept as a reference for its output """
+    nets = [set([p]) for p in sorted(set([p for adj in adjacencies for p in adj]))]
+
+    while True:
+        merged_something = False
+        i = 0
+        while i < len(nets) - 1:
+            nets_to_merge = set()
+            for p in nets[i]:
+                for j in range(i + 1, len(nets)):
+                    for q in nets[j]:
+                        if sort_adj(p, q) in adjacencies:
+                            nets_to_merge.add(j)
+                            break
+
+            for j in nets_to_merge:
+                nets[i] = nets[i].union(nets[j])
+
+            nets = [n for j, n in enumerate(nets) if j not in nets_to_merge]
+
+            if nets_to_merge:
+                merged_something = True
+
+            i += 1
+
+        if not merged_something:
+            break
+
+    return [sorted(net) for net in sorted(nets)]
+
+
+def bench_nets(args) -> dict:
+    adjacencies = random_adjacencies(args.connections)
+
+    results = {
+        'connections': len(adjacencies),
+        'union_find_s': best_time(lambda: build_nets(adjacencies), args.repeat),
+    }
+
+    if not args.skip_reference:
+        if quadratic_build_nets(adjacencies) != build_nets(adjacencies):
+            raise RuntimeError("build_nets output differs from the reference implementation")
+
+        results['quadratic_s'] = best_time(lambda: quadratic_build_nets(adjacencies), 1)
+
+    return results
+
+
+# A mix of factory, regular core and templated part module IDs, weighted towards
+# the passives that make up most of a typical sketch
+SAMPLE_MODULE_IDS = [
+    'ResistorModuleID', 'ResistorModuleID', 'ResistorModuleID', 'ResistorModuleID',
+    'CapacitorModuleID', 'CapacitorModuleID', 'ElectrolyticCapacitorModuleID',
+    '5mmColorLEDModuleID', '3mmColorLEDModuleID', '1206ColorLEDModuleID', 'WireModuleID',
+    'PotentiometerModuleID', 'TrimmerPotentiometerModuleID', 'PowerLabelModuleID',
+    'arduino_Uno_Rev3(fix)', 'NetLabelModuleID', 'GroundModuleID',
+    'screw_terminal_2_3.5mm', 'generic_ic_dip_8_300mil', 'generic_female_pin_header_4_100mil',
+    'cd4017', '1000FADF10011leg1', 'SparkFun-Connectors-USB-B-SMT',
+]
+
+
+class LinearSuffixMatcher:
+    """ The list scan SuffixMatcher used before its trie, kept as a reference """
+
+    def __init__(self, elems: Dict[str, object]):
+        keys = sorted(elems.keys(), key=lambda k: len(k), reverse=True)
+        self._entries = [(k, elems[k]) for k in keys]
+
+    def lookup(self, module_id: str, default):
+        for k, v in self._entries:
+            if k[0] == '^' and k[1:] == module_id:
+                return v
+
+            if module_id.endswith(k):
+                return v
+        return default
+
+
+def bench_suffix(args) -> dict:
+    rng = random.Random(0)
+    stream = [rng.choice(SAMPLE_MODULE_IDS) for _ in range(args.lookups)]
+
+    results = {'lookups': len(stream)}
+    for name, matcher in [
+        ('factory_parts', FACTORY_PART_MODULE_ID_SUFFIXES),
+        ('title_overrides', FACTORY_PART_TITLE_OVERRIDES),
+        ('description_overrides', FACTORY_PART_LONG_DESCRIPTION_OVERRIDES),
+    ]:
+        reference = LinearSuffixMatcher(dict(matcher.items()))
+        if [matcher.lookup(m, None) for m in stream] != [reference.lookup(m, None) for m in stream]:
+            raise RuntimeError(f"SuffixMatcher lookups for {name} differ from the reference implementation")
+
+        fresh = SuffixMatcher(dict(matcher.items()))
+        results[name] = {
+            'trie_cold_s': best_time(lambda: [fresh.lookup(m, None) for m in stream], 1),
+            'trie_s': best_time(lambda: [matcher.lookup(m, None) for m in stream], args.repeat),
+            'linear_s': best_time(lambda: [reference.lookup(m, None) for m in stream], args.repeat),
+        }
+
+    return results
+
+
+def loop_templated_lookup(module_id: str):
+    """ The per-family loop TemplatedPartMatcher replaced, kept as a reference """
+    for family_spec in TEMPLATED_PART_FAMILIES:
+        if re.compile(family_spec.id_match_pattern).match(module_id):
+            match = re.compile(family_spec.id_match_pattern).match(module_id)
+            return family_spec, {k.replace('_', ' '): v for k, v in match.groupdict().items()}
+    return None
+
+
+def bench_templated(args) -> dict:
+    # Only module IDs that aren't factory or core parts get this far
+    module_ids = [
+        'screw_terminal_2_3.5mm', 'screw_terminal_3_5.0mm', 'generic_ic_dip_8_300mil',
+        'generic_female_pin_header_4_100mil', 'generic_male_pin_header_6_100mil',
+        'generic_shrouded_pin_header_10', 'SparkFun-Connectors-USB-B-SMT',
+    ]
+    rng = random.Random(0)
+    stream = [rng.choice(module_ids) for _ in range(args.lookups)]
+
+    if [TEMPLATED_PARTS.lookup(m) for m in module_ids] != [loop_templated_lookup(m) for m in module_ids]:
+        raise RuntimeError("TemplatedPartMatcher lookups differ from the reference implementation")
+
+    fresh = TemplatedPartMatcher(TEMPLATED_PART_FAMILIES)
+    return {
+        'lookups': len(stream),
+        'combined_cold_s': best_time(lambda: [fresh._find(m) for m in stream], args.repeat),
+        'combined_s': best_time(lambda: [TEMPLATED_PARTS.lookup(m) for m in stream], args.repeat),
+        'loop_s': best_time(lambda: [loop_templated_lookup(m) for m in stream], args.repeat),
+    }
+
+
+def random_schematic(connection_count: int, seed: int = 0) -> Schematic:
+    """ A schematic with many-pinned parts and a ground net, without needing any part files """
+    rng = random.Random(seed)
+    schematic = Schematic()
+    schematic.part_instances_by_id[GROUND_PART_INSTANCE.part_instance_id] = GROUND_PART_INSTANCE
+
+    part_count = max(1, connection_count // 8)
+    for i in range(part_count):
+        pins = {
+            f"connector{j}": PartPin(pin_id=f"connector{j}", short_name=str(j + 1), description=f"Pin {j} of part {i}")
+            for j in range(rng.randint(2, 16))
+        }
+        part = Part(
+            part_id=f"part{i % 50}",
+            short_name=f"Part {i % 50}",
+            description='A part',
+            designator_prefix='U',
+            pins=pins,
+        )
+        schematic.part_instances_by_id[str(i)] = PartInstance(part_instance_id=str(i), designator=f"U{i}", part=part)
+
+    instances = list(schematic.part_instances_by_id.values())
+    for n in range(max(1, connection_count // 4)):
+        connections = []
+        if rng.random() < 0.25:
+            connections.append(Connection(part_instance=GROUND_PART_INSTANCE, pin_id='common'))
+        for _ in range(4):
+            inst = rng.choice(instances)
+            connections.append(Connection(part_instance=inst, pin_id=rng.choice(list(inst.part.pins.keys()))))
+        schematic.nodes_by_id[f"node{n}"] = Node(node_id=f"node{n}", label=None, connections=connections)
+
+    return schematic
+
+
+class ComparingPart(Part):
+    """ Part's render-time methods from before they were precomputed, kept as a reference """
+
+    def _is_ground(self) -> bool:
+        # What the generated dataclass equality with GROUND_PART compared
+        fields = lambda p: (p.part_id, p.short_name, p.description, p.designator_prefix, p.pins)
+        return fields(self) == fields(GROUND_PART)
+
+    def should_show_in_bom(self) -> bool:
+        return not self._is_ground()
+
+    def pin_reference(self, pin_id: PinID) -> str:
+        if self._is_ground():
+            return ''
+
+        kind = 'lead' if len(self.pins) <= 3 else 'pin'
+
+        short_name = self.pins[pin_id].short_name
+        if short_name.isnumeric():
+            return f"{kind} {short_name}"
+        else:
+            return f"{short_name} {kind}"
+
+    def should_show_pin_descriptions(self):
+        if len(self.pins) < 3:
+            return False
+
+        if all((p.description is None or p.short_name.lower() == p.description.lower() for p in self.pins.values())):
+            return False
+
+        first_pin = next(iter(self.pins.values()))
+        if all((first_pin.description == p.description for p in self.pins.values())):
+            return False
+
+        return True
+
+
+def with_comparing_parts(schematic: Schematic) -> Schematic:
+    """ A copy of schematic whose parts are ComparingParts """
+    parts: Dict[int, ComparingPart] = {}
+    instances: Dict[int, PartInstance] = {}
+
+    def instance(inst: PartInstance) -> PartInstance:
+        if id(inst) not in instances:
+            part = parts.get(id(inst.part))
+            if part is None:
+                part = parts[id(inst.part)] = ComparingPart(
+                    **{f.name: getattr(inst.part, f.name) for f in dataclasses.fields(Part)}
+                )
+            instances[id(inst)] = PartInstance(inst.part_instance_id, inst.designator, part)
+        return instances[id(inst)]
+
+    return Schematic(
+        part_instances_by_id={k: instance(v) for k, v in schematic.part_instances_by_id.items()},
+        nodes_by_id={
+            k: Node(n.node_id, n.label, [Connection(instance(c.part_instance), c.pin_id) for c in n.connections])
+            for k, n in schematic.nodes_by_id.items()
+        },
+    )
+
+
+def uncached_describe_as_html(schematic: Schematic) -> str:
+    """ describe_as_html from before the environment and template were cached, kept as a reference """
+    jinja_env = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE_DIR))
+    jinja_env.filters["nl2br"] = nl2br
+    jinja_env.globals["render_row"] = render_row
+    return jinja_env.get_template(TEMPLATE_NAME).render(schematic=schematic, parts=collect_parts(schematic))
+
+
+def bench_render(args) -> dict:
+    schematic = random_schematic(args.connections)
+    reference = with_comparing_parts(schematic)
+
+    if uncached_describe_as_html(reference) != describe_as_html(schematic):
+        raise RuntimeError("describe_as_html output differs from the reference implementation")
+
+    return {
+        'connections': sum(len(n.connections) for n in schematic.nodes_by_id.values()),
+        'render_s': best_time(lambda: describe_as_html(schematic), args.repeat),
+        # Without the cached environment and template, and then also without the precomputed parts
+        'uncached_template_s': best_time(lambda: uncached_describe_as_html(schematic), args.repeat),
+        'reference_s': best_time(lambda: uncached_describe_as_html(reference), args.repeat),
+    }
+
+
+def allocated_bytes(fn: Callable[[], object]) -> Tuple[object, int]:
+    """ Calls fn and returns its result along with how many bytes it left allocated """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+# The models that are slotted to save memory
+SLOTTED_MODELS = (PinRef, PartPin, PartInstance, Connection, Node)
+
+
+def unslotted(cls: type) -> type:
+    """ A plain dataclass with the same fields and options as cls, i.e. cls before it had slots """
+    params = cls.__dataclass_params__
+    return dataclasses.make_dataclass(
+        cls.__name__,
+        [(f.name, f.type) for f in dataclasses.fields(cls)],
+        eq=params.eq,
+        order=params.order,
+        frozen=params.frozen,
+    )
+
+
+UNSLOTTED_MODELS = {cls: unslotted(cls) for cls in SLOTTED_MODELS}
+
+
+def copy_models(obj: object, classes: Dict[type, type], memo: Dict[int, object]) -> object:
+    """
+    Copies the dataclasses of the types in classes that are reachable from obj through dicts,
+    lists, tuples and sets, making each one an instance of classes[type]. Everything else,
+    strings included, is shared with obj, so two copies made with different classes differ
+    only in how the models are laid out.
+    """
+    if id(obj) in memo:
+        return memo[id(obj)]
+
+    if isinstance(obj, dict):
+        copy = {k: copy_models(v, classes, memo) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple, set)):
+        copy = type(obj)(copy_models(v, classes, memo) for v in obj)
+    elif type(obj) in classes:
+        copy = classes[type(obj)](**{
+            f.name: copy_models(getattr(obj, f.name), classes, memo) for f in dataclasses.fields(obj)
+        })
+    else:
+        return obj
+
+    memo[id(obj)] = copy
+    return copy
+
+
+def model_bytes(obj: object, classes: Tuple[type, ...]) -> Dict[str, int]:
+    """ The bytes taken by obj's models as they are, and as they'd be without slots """
+    slotted = {cls: cls for cls in classes}
+    copy_models(obj, slotted, {})  # The first copy also allocates some one-off caches
+    return {
+        'slotted': allocated_bytes(lambda: copy_models(obj, slotted, {}))[1],
+        'unslotted': allocated_bytes(lambda: copy_models(obj, {**slotted, **UNSLOTTED_MODELS}, {}))[1],
+    }
+
+
+def per_item(byte_counts: Dict[str, int], count: int) -> Dict[str, float]:
+    return {k: v / max(1, count) for k, v in byte_counts.items()}
+
+
+def bench_memory(args) -> dict:
+    core_dir = None if args.parts_dir else synthetic_core_dir(args)
+    parts_bin, parts_bytes = allocated_bytes(lambda: load_core_parts(cache_path=None, dirs=args.parts_dir or [core_dir]))
+    parts = {k: parts_bin[k] for k in parts_bin}
+    pin_count = sum(len(p.pins) for p in parts.values())
+
+    if args.sketch:
+        sketch_bin, path = parts_bin, args.sketch
+    else:
+        # The largest of the sketches the pipeline benchmark would use, which needs the synthetic parts
+        if core_dir is None:
+            core_dir = synthetic_core_dir(args)
+            sketch_bin = load_core_parts(cache_path=None, dirs=[core_dir])
+        else:
+            sketch_bin = parts_bin
+        path = write_synthetic_sketch(os.path.dirname(core_dir), max(args.sizes), args.core_parts)
+
+    schematic, schematic_bytes = allocated_bytes(lambda: parse_sketch(sketch_bin, path))
+    connection_count = sum(len(n.connections) for n in schematic.nodes_by_id.values())
+    adjacencies = net_adjacencies(*read_sketch(sketch_bin, path))
+
+    # Parts aren't slotted themselves, but their pins are. The parts a schematic refers to
+    # belong to the bin, so they're left out of its numbers.
+    return {
+        'parts': len(parts),
+        'pins': pin_count,
+        'bytes_per_part': parts_bytes / max(1, len(parts)),
+        'model_bytes_per_part': per_item(model_bytes(parts, SLOTTED_MODELS + (FzPart,)), len(parts)),
+        'sketch': path,
+        'connections': connection_count,
+        'schematic_bytes_per_connection': schematic_bytes / max(1, connection_count),
+        'model_bytes_per_connection': per_item(model_bytes(schematic, SLOTTED_MODELS + (Schematic,)), connection_count),
+        'adjacencies': len(adjacencies),
+        'model_bytes_per_adjacency': per_item(model_bytes(adjacencies, SLOTTED_MODELS), len(adjacencies)),
+    }
+
+
+def read_sketch(parts_bin: PartsBin, path: str) -> Tuple[PartsBin, List[InstanceRecord]]:
+    """ The unzipping and XML parsing half of parse_sketch """
+    parts_bin = parts_bin.overlay()
+    with ZipFile(path, 'r') as zf:
+        fzp_files, fz_file = find_sketch_files(zf)
+        for fzp_file in fzp_files:
+            with zf.open(fzp_file) as fh:
+                part = parse_part_file(fh)
+                parts_bin[part.part_id] = part
+
+        with zf.open(fz_file) as fh:
+            return parts_bin, [read_instance(e) for e in iter_instances(fh)]
+
+
+def net_adjacencies(parts_bin: PartsBin, records: List[InstanceRecord]) -> Set[Tuple[PinRef, PinRef]]:
+    """ Builds the schematic and returns the adjacencies it merged into nets """
+    captured = []
+
+    def capturing_build_nets(adjacencies):
+        captured.append(adjacencies)
+        return build_nets(adjacencies)
+
+    build_schematic(parts_bin, records, capturing_build_nets)
+    return captured[0]
+
+
+def bench_sketch_stages(parts_bin: PartsBin, path: str, repeat: int) -> dict:
+    sketch_bin, records = read_sketch(parts_bin, path)
+    schematic = build_schematic(sketch_bin, records)
+    adjacencies = net_adjacencies(sketch_bin, records)
+    html = describe_as_html(schematic)  # Also warms up the template
+
+    # Each stage is timed on the previous stage's output. Net merging is part of building
+    # the schematic but is also timed on its own, since it's the part that scales worst.
+    return {
+        'instances': len(records),
+        'adjacencies': len(adjacencies),
+        'nets': len(schematic.nodes_by_id),
+        'html_bytes': len(html.encode('utf-8')),
+        'read_s': best_time(lambda: read_sketch(parts_bin, path), repeat),
+        'build_s': best_time(lambda: build_schematic(sketch_bin, records), repeat),
+        'net_merge_s': best_time(lambda: build_nets(adjacencies), repeat),
+        'collect_parts_s': best_time(lambda: collect_parts(schematic), repeat),
+        'render_s': best_time(lambda: describe_as_html(schematic), repeat),
+    }
+
+
+def compare_results(baseline: dict, results: dict, path: str = '') -> Dict[str, float]:
+    """ Returns the ratio of each timing in results to the same timing in baseline """
+    ratios = {}
+    for key, value in results.items():
+        other = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict) and isinstance(other, dict):
+            ratios.update(compare_results(other, value, f"{path}{key}."))
+        elif key.endswith('_s') and isinstance(other, (int, float)) and other > 0:
+            ratios[path + key] = value / other
+
+    return ratios
+
+
+def bench_pipeline(args) -> dict:
+    """ End to end on synthetic sketches of increasing size, stage by stage """
+    core_dir = synthetic_core_dir(args)
+    fixture_dir = os.path.dirname(core_dir)
+    cache_path = os.path.join(fixture_dir, 'parts_bin.pickle')
+
+    load_core_parts(cache_path=cache_path, rebuild_cache=True, dirs=[core_dir])
+    results = {
+        'core_parts': args.core_parts,
+        'parts_load_s': best_time(lambda: load_core_parts(cache_path=None, dirs=[core_dir]), args.repeat),
+        'parts_load_cached_s': best_time(lambda: load_core_parts(cache_path=cache_path, dirs=[core_dir]), args.repeat),
+        'sketches': {},
+    }
+
+    parts_bin = load_core_parts(cache_path=cache_path, dirs=[core_dir])
+    for size in args.sizes:
+        path = write_synthetic_sketch(fixture_dir, size, args.core_parts)
+
+        stages = bench_sketch_stages(parts_bin, path, args.repeat)
+        stages['total_s'] = sum(v for k, v in stages.items() if k.endswith('_s') and k != 'net_merge_s')
+        results['sketches'][str(size)] = {'parts': size, 'wires': 2 * size, **stages}
+
+    if args.compare:
+        with open(args.compare, 'r') as fh:
+            results['vs_baseline'] = compare_results(json.load(fh), results)
+
+    return results
+
+
+class PageHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves PageHandler.pages (path -> HTML) with keep-alive, like a real site would """
+    protocol_version = 'HTTP/1.1'
+    pages: Dict[str, bytes] = {}
+
+    def do_GET(self):
+        body = self.pages.get(self.path)
+        self.send_response(200 if body is not None else 404)
+        body = body if body is not None else b'Not found'
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_scrape(args) -> dict:
+    """ Scrapes project pages served locally, either synthetic ones or saved copies of real ones """
+    # Imported here so the other benchmarks don't need selenium installed
+    from dataclasses import asdict
+    from http_client import HttpClient
+    from scraper import DriverPool, scrape_projects
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    server.daemon_threads = True
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    expected = {}
+    if args.pages_dir:
+        for name in sorted(os.listdir(args.pages_dir)):
+            if name.endswith('.html'):
+                with open(os.path.join(args.pages_dir, name), 'rb') as fh:
+                    PageHandler.pages[f"/projects/{name[:-len('.html')]}"] = fh.read()
+    else:
+        for i in range(args.pages):
+            page, listing = project_page_html(base_url, i)
+            PageHandler.pages[listing['url'][len(base_url):]] = page.encode('utf-8')
+            expected[listing['url']] = listing
+
+    urls = [base_url + path for path in PageHandler.pages]
+
+    def run(backend: str) -> dict:
+        start = time.perf_counter()
+        with HttpClient(max_idle_per_host=args.workers) as client, DriverPool(args.workers) as pool:
+            if backend == 'http':
+                results = list(scrape_projects(urls, client=client, workers=args.workers))
+            else:
+                results = list(scrape_projects(urls, pool))
+        seconds = time.perf_counter() - start
+
+        failed = [url for url, r in results if isinstance(r, Exception)]
+        mismatched = [url for url, r in results if url in expected and not isinstance(r, Exception)
+                      and asdict(r) != expected[url]]
+        if mismatched:
+            raise RuntimeError(f"Scraped listings differ from the generated ones, e.g. {mismatched[0]}")
+
+        return {'seconds': seconds, 'pages_per_s': len(urls) / seconds, 'failed': len(failed)}
+
+    try:
+        results = {'pages': len(urls), 'workers': args.workers, 'http': run('http')}
+        if args.browser:
+            results['browser'] = run('browser')
+            results['speedup'] = results['browser']['seconds'] / results['http']['seconds']
+    finally:
+        server.shutdown()
+
+    return results
+
+
+BENCHMARKS = {
+    'parts-load': bench_parts_load,
+    'nets': bench_nets,
+    'suffix': bench_suffix,
+    'templated': bench_templated,
+    'render': bench_render,
+    'memory': bench_memory,
+    'pipeline': bench_pipeline,
+    'scrape': bench_scrape,
+}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Time parts of the describer pipeline')
+    arg_parser.add_argument('benchmark', choices=sorted(BENCHMARKS.keys()))
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    arg_parser.add_argument('--connections', type=int, default=1000)
+    arg_parser.add_argument('--lookups', type=int, default=100000)
+    arg_parser.add_argument(
+        '--skip-reference',
+        action='store_true',
+        help="Don't check against (or time) the old quadratic net merging, which is very slow",
+    )
+    arg_parser.add_argument(
+        '--sizes',
+        type=lambda s: [int(n) for n in s.split(',')],
+        default=[10, 100, 1000],
+        help='Comma separated part counts of the synthetic sketches to time (pipeline; memory uses the largest)',
+    )
+    arg_parser.add_argument('--core-parts', type=int, default=SketchSpec.core_parts)
+    arg_parser.add_argument(
+        '--fixture-dir',
+        help='Where to write the synthetic parts and sketches (parts-load, memory, pipeline; default: a new temp dir)',
+    )
+    arg_parser.add_argument(
+        '--parts-dir',
+        action='append',
+        help='Load these part directories instead of synthetic parts, e.g. a Fritzing install (parts-load, memory)',
+    )
+    arg_parser.add_argument('--sketch', help='Measure this .fzz, parsed with the measured parts, instead of a synthetic sketch (memory)')
+    arg_parser.add_argument(
+        '--compare',
+        metavar='BASELINE',
+        help='A previous JSON result to report timing ratios against, e.g. from another commit (pipeline)',
+    )
+    arg_parser.add_argument('--pages', type=int, default=200, help='Synthetic project pages to scrape (scrape)')
+    arg_parser.add_argument('--pages-dir', help='Scrape the saved .html pages in this directory instead (scrape)')
+    arg_parser.add_argument(
+        '--browser',
+        action='store_true',
+        help='Also scrape with a pool of --workers browsers and compare (scrape; needs Firefox)',
+    )
+    args = arg_parser.parse_args()
+
+    print(json.dumps(BENCHMARKS[args.benchmark](args), indent=2))
@@ -0,0 +1,358 @@
+# Walks the fritzing.org project list and finds the projects that are new or have changed
+# since the last crawl, so they can be (re)processed without scraping everything again.
+#
+# What's been seen is kept in a SQLite checkpoint store: each project's ETag/Last-Modified
+# for conditional requests, a fingerprint of its listing, and the fingerprint it had when it
+# was last processed. Progress through the current crawl is saved as it goes, so an
+# interrupted crawl picks up where it left off.
+#
+# Usage: python crawler.py STATE.sqlite  (prints the listings to process as JSON lines)
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from itertools import islice
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from http_client import HttpClient, HttpResponse
+from scraper import (
+    ALLOWED_LICENSES,
+    DEFAULT_HTTP_WORKERS,
+    FIRST_PAGE,
+    PROJECT_LIST_URL,
+    ProjectListing,
+    parse_project_list_page,
+    parse_project_page,
+)
+
+# Project fetches queued ahead of the one being handled, per worker
+FETCHES_AHEAD_PER_WORKER = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    fingerprint TEXT,               -- Of the listing, not the page, which has ever-changing tokens
+    allowed INTEGER NOT NULL,       -- Whether the license is in ALLOWED_LICENSES
+    listing TEXT NOT NULL,          -- JSON
+    processed_fingerprint TEXT,     -- The fingerprint when it was last processed, see mark_processed
+    first_seen REAL NOT NULL,
+    last_checked REAL NOT NULL,
+    last_changed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS list_pages (
+    page INTEGER PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    project_urls TEXT NOT NULL      -- JSON list
+);
+CREATE TABLE IF NOT EXISTS crawls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+-- What the current crawl has already done: list pages by number and projects by URL
+CREATE TABLE IF NOT EXISTS crawl_progress (
+    crawl_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (crawl_id, kind, key)
+);
+"""
+
+
+@dataclass
+class CrawlStats:
+    list_pages_fetched: int = 0
+    list_pages_not_modified: int = 0
+    list_pages_resumed: int = 0
+    projects_new: int = 0
+    projects_changed: int = 0
+    projects_unchanged: int = 0
+    projects_not_modified: int = 0
+    projects_resumed: int = 0
+    projects_license_not_allowed: int = 0
+    projects_failed: int = 0
+
+
+def listing_fingerprint(listing: ProjectListing) -> str:
+    return hashlib.sha256(json.dumps(asdict(listing), sort_keys=True).encode()).hexdigest()
+
+
+def listing_from_json(data: str) -> ProjectListing:
+    return ProjectListing(**json.loads(data))
+
+
+def validator_headers(etag: Optional[str], last_modified: Optional[str]) -> Dict[str, str]:
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+class CrawlStore:
+    """ The checkpoint store. Not thread safe; use it from the thread that created it. """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def current_crawl(self) -> Tuple[int, bool]:
+        """ Returns the ID of the unfinished crawl, or of a new one, and whether it's being resumed """
+        row = self.db.execute('SELECT id FROM crawls WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1').fetchone()
+        if row is not None:
+            return row[0], True
+
+        with self.db:
+            cursor = self.db.execute('INSERT INTO crawls (started_at) VALUES (?)', (time.time(),))
+        return cursor.lastrowid, False
+
+    def finish_crawl(self, crawl_id: int):
+        with self.db:
+            self.db.execute('UPDATE crawls SET finished_at = ? WHERE id = ?', (time.time(), crawl_id))
+            self.db.execute('DELETE FROM crawl_progress WHERE crawl_id = ?', (crawl_id,))
+
+    def is_done(self, crawl_id: int, kind: str, key: str) -> bool:
+        return self.db.execute(
+            'SELECT 1 FROM crawl_progress WHERE crawl_id = ? AND kind = ? AND key = ?', (crawl_id, kind, key)
+        ).fetchone() is not None
+
+    def _mark_done(self, crawl_id: int, kind: str, key: str):
+        """ Must be called in a transaction along with the work it marks done """
+        self.db.execute('INSERT OR IGNORE INTO crawl_progress VALUES (?, ?, ?)', (crawl_id, kind, key))
+
+    def list_page(self, page: int) -> Optional[Tuple[Optional[str], Optional[str], List[str]]]:
+        """ Returns the page's validators and project URLs as of the last time it was fetched """
+        row = self.db.execute(
+            'SELECT etag, last_modified, project_urls FROM list_pages WHERE page = ?', (page,)
+        ).fetchone()
+        return None if row is None else (row[0], row[1], json.loads(row[2]))
+
+    def save_list_page(self, crawl_id: int, page: int, etag: Optional[str], last_modified: Optional[str], urls: List[str]):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO list_pages VALUES (?, ?, ?, ?)', (page, etag, last_modified, json.dumps(urls))
+            )
+            self._mark_done(crawl_id, 'page', str(page))
+
+    def project(self, url: str) -> Optional[sqlite3.Row]:
+        return self.db.execute('SELECT * FROM projects WHERE url = ?', (url,)).fetchone()
+
+    def save_project(
+        self,
+        crawl_id: int,
+        listing: ProjectListing,
+        etag: Optional[str],
+        last_modified: Optional[str],
+    ) -> str:
+        """ Stores a freshly fetched listing; returns 'new', 'changed' or 'unchanged' """
+        now = time.time()
+        fingerprint = listing_fingerprint(listing)
+        previous = self.project(listing.url)
+
+        with self.db:
+            if previous is None:
+                status = 'new'
+                self.db.execute(
+                    'INSERT INTO projects VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?, ?)',
+                    (listing.url, etag, last_modified, fingerprint, listing.license_url in ALLOWED_LICENSES,
+                     json.dumps(asdict(listing)), now, now, now),
+                )
+            else:
+                status = 'unchanged' if previous['fingerprint'] == fingerprint else 'changed'
+                self.db.execute(
+                    'UPDATE projects SET etag = ?, last_modified = ?, fingerprint = ?, allowed = ?, listing = ?, '
+                    'last_checked = ?, last_changed = ? WHERE url = ?',
+                    (etag, last_modified, fingerprint, listing.license_url in ALLOWED_LICENSES,
+                     json.dumps(asdict(listing)), now, previous['last_changed'] if status == 'unchanged' else now,
+                     listing.url),
+                )
+            self._mark_done(crawl_id, 'project', listing.url)
+
+        return status
+
+    def touch_project(self, crawl_id: int, url: str):
+        """ Records that the project was checked and hadn't changed (e.g. a 304) """
+        with self.db:
+            self.db.execute('UPDATE projects SET last_checked = ? WHERE url = ?', (time.time(), url))
+            self._mark_done(crawl_id, 'project', url)
+
+    def skip_project(self, crawl_id: int, url: str):
+        """ Gives up on the project for this crawl (e.g. it failed); the next crawl tries again """
+        with self.db:
+            self._mark_done(crawl_id, 'project', url)
+
+    def needs_processing(self, url: str) -> Optional[ProjectListing]:
+        """ Returns the listing if the project is allowed and hasn't been processed since it last changed """
+        row = self.db.execute(
+            'SELECT listing FROM projects WHERE url = ? AND allowed AND '
+            '(processed_fingerprint IS NULL OR processed_fingerprint != fingerprint)',
+            (url,),
+        ).fetchone()
+        return None if row is None else listing_from_json(row[0])
+
+    def mark_processed(self, listing: ProjectListing):
+        """ Call once a listing from crawl() has been dealt with, so it isn't handed out again """
+        with self.db:
+            self.db.execute(
+                'UPDATE projects SET processed_fingerprint = ? WHERE url = ?',
+                (listing_fingerprint(listing), listing.url),
+            )
+
+
+def fetch_project(client: HttpClient, url: str, validators: Dict[str, str]) -> Tuple[HttpResponse, Optional[ProjectListing]]:
+    """ Runs in a worker thread. The listing is None if the page hasn't changed (a 304). """
+    response = client.get(url, headers=validators)
+    if response.status == 304:
+        return response, None
+    if response.status != 200:
+        raise RuntimeError(f"HTTP {response.status} fetching {url}")
+
+    return response, parse_project_page(url, response.body, base_url=response.url)
+
+
+def crawl(
+    store: CrawlStore,
+    client: HttpClient,
+    first_page: int = FIRST_PAGE,
+    last_page: Optional[int] = None,
+    workers: int = DEFAULT_HTTP_WORKERS,
+    stats: Optional[CrawlStats] = None,
+) -> Iterator[ProjectListing]:
+    """
+    Crawls the project list from first_page until a page without projects (or last_page),
+    and yields the listings of allowed projects that are new or changed since they were last
+    processed. Call store.mark_processed(listing) once each one has been dealt with; anything
+    that isn't is yielded again by the next crawl. Projects whose license isn't allowed are
+    never yielded, so nothing of theirs gets downloaded.
+    """
+    stats = stats if stats is not None else CrawlStats()
+    crawl_id, resuming = store.current_crawl()
+
+    # Gather the project URLs from the list pages
+    project_urls: List[str] = []
+    seen_urls: Set[str] = set()
+    page = first_page
+    while last_page is None or page <= last_page:
+        saved = store.list_page(page)
+        if resuming and saved is not None and store.is_done(crawl_id, 'page', str(page)):
+            urls = saved[2]
+            stats.list_pages_resumed += 1
+        else:
+            url = PROJECT_LIST_URL.format(page=page)
+            response = client.get(url, headers=validator_headers(*saved[:2]) if saved else {})
+            etag, last_modified = response.headers.get('etag'), response.headers.get('last-modified')
+            if response.status == 304:
+                urls = saved[2]
+                stats.list_pages_not_modified += 1
+                # A 304 doesn't have to repeat the validators, so keep the ones it doesn't send
+                etag, last_modified = etag or saved[0], last_modified or saved[1]
+            elif response.status == 404:  # Past the last page
+                break
+            elif response.status != 200:
+                raise RuntimeError(f"HTTP {response.status} fetching {url}")
+            else:
+                urls = parse_project_list_page(response.url, response.body)
+                stats.list_pages_fetched += 1
+            store.save_list_page(crawl_id, page, etag, last_modified, urls)
+
+        if not urls:
+            break
+        for u in urls:
+            if u not in seen_urls:
+                seen_urls.add(u)
+                project_urls.append(u)
+        page += 1
+
+    # Check each project, conditionally if we've seen it before
+    to_fetch: List[Tuple[str, Dict[str, str]]] = []
+    for url in project_urls:
+        if store.is_done(crawl_id, 'project', url):
+            stats.projects_resumed += 1
+            listing = store.needs_processing(url)
+            if listing is not None:
+                yield listing
+            continue
+
+        previous = store.project(url)
+        to_fetch.append((url, validator_headers(previous['etag'], previous['last_modified']) if previous else {}))
+
+    # Only a few fetches are queued ahead of the one being handled, so stopping early (closing
+    # the generator, or Ctrl-C) doesn't wait for every project to be fetched first
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending: Deque[Tuple[str, Future]] = deque()
+    queued = iter(to_fetch)
+    try:
+        # The store is only touched from this thread; results are handled in order
+        while True:
+            for url, validators in islice(queued, FETCHES_AHEAD_PER_WORKER * workers - len(pending)):
+                pending.append((url, executor.submit(fetch_project, client, url, validators)))
+            if not pending:
+                break
+
+            url, future = pending.popleft()
+            try:
+                response, listing = future.result()
+            except Exception as e:
+                print(f"Could not fetch {url}: {type(e).__name__}: {e}", file=sys.stderr)
+                store.skip_project(crawl_id, url)
+                stats.projects_failed += 1
+                continue
+
+            if listing is None:
+                store.touch_project(crawl_id, url)
+                stats.projects_not_modified += 1
+            else:
+                status = store.save_project(
+                    crawl_id, listing, response.headers.get('etag'), response.headers.get('last-modified')
+                )
+                setattr(stats, f"projects_{status}", getattr(stats, f"projects_{status}") + 1)
+                if listing.license_url not in ALLOWED_LICENSES:
+                    stats.projects_license_not_allowed += 1
+
+            listing = store.needs_processing(url)
+            if listing is not None:
+                yield listing
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    store.finish_crawl(crawl_id)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Find new and changed Fritzing projects, printing their listings as JSON lines')
+    arg_parser.add_argument('state', help='The checkpoint store (an SQLite file, created if missing)')
+    arg_parser.add_argument('--first-page', type=int, default=FIRST_PAGE)
+    arg_parser.add_argument('--last-page', type=int, help='Default: until a page without projects')
+    arg_parser.add_argument('--workers', type=int, default=DEFAULT_HTTP_WORKERS)
+    arg_parser.add_argument(
+        '--no-mark-processed',
+        action='store_true',
+        help="Don't mark the printed listings as processed, so the next crawl prints them again",
+    )
+    args = arg_parser.parse_args()
+
+    stats = CrawlStats()
+    store = CrawlStore(args.state)
+    try:
+        with HttpClient(max_idle_per_host=args.workers) as client:
+            for listing in crawl(store, client, args.first_page, args.last_page, args.workers, stats):
+                print(json.dumps(asdict(listing)), flush=True)
+                if not args.no_mark_processed:
+                    store.mark_processed(listing)
+    finally:
+        store.close()
+        print(json.dumps(asdict(stats)), file=sys.stderr)
@@ -1,8 +1,13 @@
 from collections import defaultdict
+import functools
+import hashlib
+import os
+from typing import Dict, Iterator, Optional, Set, TextIO
 
 import jinja2
 
 from models import *
+import instrumentation
 
 @dataclass
 class PartInfo:
@@ -36,9 +41,168 @@ def nl2br(eval_ctx, value):
     return value.replace("\n", "<br>\n")
 
 
-def describe_as_html(schematic: Schematic) -> str:
-    jinja_env = jinja2.Environment(loader=jinja2.FileSystemLoader("."))
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_NAME = 'template.html.jinja2'
+# Written by precompile_templates; used instead of compiling the template source if up to date
+COMPILED_TEMPLATE_DIR = os.path.join(TEMPLATE_DIR, '.compiled_templates')
+
+
+def render_row(kind: str, macro: jinja2.runtime.Macro, *args) -> str:
+    """ Renders a row of one of the tables in the template; see RowCache """
+    return macro(*args)
+
+
+class RowCache:
+    """
+    Remembers the rendered HTML of each table row by the values that go into it. Passed to the
+    template in place of render_row, it means re-rendering a slightly changed schematic only
+    renders the rows that changed.
+
+    Parts are identified by identity rather than by ID, since a part with the same ID can
+    change between renders (e.g. a sketch's bundled part being edited). Parts aren't modified
+    after they're rendered, so the same object always renders the same way.
+    """
+
+    def __init__(self):
+        self._rows: Dict[tuple, str] = {}
+        self._used: Set[tuple] = set()
+        # The parts in the keys by id(), so an id can't be reused while a row refers to it
+        self._parts: Dict[int, Part] = {}
+        self._used_parts: Dict[int, Part] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _part_key(self, part: Part) -> int:
+        self._parts[id(part)] = part
+        self._used_parts[id(part)] = part
+        return id(part)
+
+    def row_key(self, kind: str, *args) -> tuple:
+        if kind == 'bom':
+            part_info, = args
+            return (kind, self._part_key(part_info.part), tuple(i.designator for i in part_info.instances))
+        elif kind == 'net':
+            net, index = args
+            return (kind, index, net.label, tuple(
+                (c.part_instance.designator, self._part_key(c.part_instance.part), c.pin_id) for c in net.connections
+            ))
+        elif kind == 'details':
+            part_info, = args
+            return (kind, self._part_key(part_info.part))
+        else:
+            raise ValueError(f"Unknown row kind {kind}")
+
+    def __call__(self, kind: str, macro: jinja2.runtime.Macro, *args) -> str:
+        key = self.row_key(kind, *args)
+        self._used.add(key)
+
+        html = self._rows.get(key)
+        if html is None:
+            self.misses += 1
+            html = self._rows[key] = macro(*args)
+        else:
+            self.hits += 1
+
+        return html
+
+    def start_render(self):
+        """ Resets the counters; call before each render """
+        self.hits = 0
+        self.misses = 0
+        self._used = set()
+        self._used_parts = {}
+
+    def prune(self):
+        """ Forgets rows that weren't used by the last render, so the cache doesn't grow forever """
+        self._rows = {k: v for k, v in self._rows.items() if k in self._used}
+        # Parts from older renders can be let go now, since no remaining row refers to them
+        self._parts = self._used_parts
+
+
+@functools.lru_cache(maxsize=None)
+def template_version() -> str:
+    """ Changes whenever the template does, so cached output can be invalidated """
+    with open(os.path.join(TEMPLATE_DIR, TEMPLATE_NAME), 'rb') as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+
+def has_fresh_compiled_templates() -> bool:
+    try:
+        compiled_mtime = os.path.getmtime(COMPILED_TEMPLATE_DIR)
+    except OSError:
+        return False
+
+    return compiled_mtime >= os.path.getmtime(os.path.join(TEMPLATE_DIR, TEMPLATE_NAME))
+
+
+@functools.lru_cache(maxsize=None)
+def get_jinja_env() -> jinja2.Environment:
+    loader = jinja2.FileSystemLoader(TEMPLATE_DIR)
+    if has_fresh_compiled_templates():
+        loader = jinja2.ChoiceLoader([jinja2.ModuleLoader(COMPILED_TEMPLATE_DIR), loader])
+
+    jinja_env = jinja2.Environment(loader=loader)
     jinja_env.filters["nl2br"] = nl2br
+    jinja_env.globals["render_row"] = render_row
+    return jinja_env
+
+
+@functools.lru_cache(maxsize=None)
+def get_template() -> jinja2.Template:
+    """ Loads and compiles the template once per process """
+    return get_jinja_env().get_template(TEMPLATE_NAME)
+
+
+def precompile_templates():
+    """ Compiles the template to Python modules so new processes don't have to """
+    # Compile from source even if there are stale compiled templates around
+    jinja_env = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATE_DIR))
+    jinja_env.compile_templates(
+        COMPILED_TEMPLATE_DIR,
+        filter_func=lambda name: name == TEMPLATE_NAME,
+        zip=None,
+        ignore_errors=False,
+    )
+    os.utime(COMPILED_TEMPLATE_DIR)  # Mark it up to date even if no files changed
+
+    get_jinja_env.cache_clear()
+    get_template.cache_clear()
+
+
+@instrumentation.stage('render')
+def describe_as_html(schematic: Schematic, row_cache: Optional[RowCache] = None) -> str:
+    if row_cache is None:
+        return get_template().render(schematic=schematic, parts=collect_parts(schematic))
+
+    row_cache.start_render()
+    html = get_template().render(schematic=schematic, parts=collect_parts(schematic), render_row=row_cache)
+    row_cache.prune()
+    return html
+
+
+# Number of template output pieces joined into each chunk when streaming. Each piece is
+# usually a short run of markup or one value, so this gives chunks of a few KB.
+DEFAULT_STREAM_BUFFER_SIZE = 256
+
+
+def iter_html_chunks(schematic: Schematic, buffer_size: int = DEFAULT_STREAM_BUFFER_SIZE) -> Iterator[str]:
+    """
+    Yields the same HTML as describe_as_html a chunk at a time as it is rendered, so the
+    whole document never has to be in memory. A buffer_size of 1 or less disables buffering.
+    """
+    stream = get_template().stream(schematic=schematic, parts=collect_parts(schematic))
+    if buffer_size > 1:
+        stream.enable_buffering(buffer_size)
+    return stream
+
+
+@instrumentation.stage('render')
+def stream_html(schematic: Schematic, out: TextIO, buffer_size: int = DEFAULT_STREAM_BUFFER_SIZE):
+    """ Writes the HTML description to out (e.g. a file or socket.makefile('w')) as it's rendered """
+    for chunk in iter_html_chunks(schematic, buffer_size):
+        out.write(chunk)
+        out.flush()
+
 
-    template = jinja_env.get_template("template.html.jinja2")
-    return template.render(schematic=schematic, parts=collect_parts(schematic))
+if __name__ == '__main__':
+    precompile_templates()
@@ -0,0 +1,91 @@
+# The parts shared by the on-disk caches (result_cache.py and download_cache.py): atomic
+# writes, least recently used eviction by mtime, and a stats file shared between processes.
+import fcntl
+import json
+import os
+import tempfile
+from typing import Callable, List, Optional
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+STATS_FILE = 'stats.json'
+
+
+class DiskCache:
+    """
+    A directory of entry files ending in EXTENSION. Subclasses bump an entry's mtime when they
+    use it, and evict() deletes the least recently used entries when they add up to more than
+    max_bytes. Writes are atomic renames, so several processes can share a cache directory.
+    """
+
+    EXTENSION: str
+
+    cache_dir: str
+    max_bytes: int
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _write_atomic(self, path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        """ Deletes the least recently used entries, except keep, until the cache fits. Returns their paths. """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(self.EXTENSION):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:  # Evicted by someone else
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+
+        evicted = []
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+                evicted.append(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        return evicted
+
+    def _update_stats(self, update: Callable[[dict], None]):
+        """ Applies update to the stats file, which is shared by every user of the cache """
+        with open(os.path.join(self.cache_dir, STATS_FILE), 'a+') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            fh.seek(0)
+            stats = json.loads(fh.read() or '{}')
+
+            update(stats)
+
+            fh.seek(0)
+            fh.truncate()
+            json.dump(stats, fh)
+
+    def _read_stats(self) -> dict:
+        try:
+            with open(os.path.join(self.cache_dir, STATS_FILE), 'r') as fh:
+                return json.loads(fh.read() or '{}')
+        except FileNotFoundError:
+            return {}
+
+    def _entry_sizes(self) -> List[int]:
+        sizes = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(self.EXTENSION):
+                try:
+                    sizes.append(entry.stat().st_size)
+                except FileNotFoundError:
+                    pass
+        return sizes
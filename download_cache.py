@@ -0,0 +1,184 @@
+# An on-disk cache of downloaded .fzz archives. Archives are stored by the hash of their
+# content, and each URL remembers which archive it last gave us along with its ETag and
+# Last-Modified, so checking an archive for changes is a conditional request that usually
+# comes back 304 with no body.
+#
+# Usage: python download_cache.py stats CACHE_DIR
+#        python download_cache.py fetch CACHE_DIR URL  (prints the path of the cached archive)
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+from disk_cache import DEFAULT_MAX_BYTES, DiskCache
+from http_client import HttpClient
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'circuit-describer', 'downloads')
+ARCHIVE_EXTENSION = '.fzz'
+URL_DIR = 'urls'
+
+
+@dataclass
+class CachedDownload:
+    url: str
+    path: str
+    sha256: str
+    status: str  # 'downloaded', 'revalidated' (the server said it hadn't changed) or 'deduplicated'
+
+
+class DownloadCache(DiskCache):
+    """
+    Archives are named by the SHA-256 of their content, so two URLs serving the same file share
+    one copy. Per URL metadata (which archive, and the validators to revalidate it with) lives
+    in urls/, named by the hash of the URL, and is deleted along with the archive it points to.
+    """
+
+    EXTENSION = ARCHIVE_EXTENSION
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+        os.makedirs(os.path.join(cache_dir, URL_DIR), exist_ok=True)
+
+    def _archive_path(self, sha256: str) -> str:
+        return os.path.join(self.cache_dir, sha256 + ARCHIVE_EXTENSION)
+
+    def _url_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, URL_DIR, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    def _read_url_entry(self, url: str) -> Optional[dict]:
+        try:
+            with open(self._url_path(url), 'r') as fh:
+                entry = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # The archive may have been evicted, in which case the validators are no use
+        if entry.get('url') != url or not os.path.exists(self._archive_path(entry['sha256'])):
+            return None
+        return entry
+
+    def fetch(self, client: HttpClient, url: str) -> CachedDownload:
+        """ Returns the cached archive for url, downloading it only if it's new or has changed """
+        entry = self._read_url_entry(url)
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = client.get(url, headers=headers)
+
+        if response.status == 304 and entry is not None:
+            path = self._archive_path(entry['sha256'])
+            try:
+                os.utime(path)  # Mark it as recently used
+            except FileNotFoundError:  # Evicted since we looked; download it again
+                return self._download(client, url)
+            self.record('revalidated', 0)
+            return CachedDownload(url=url, path=path, sha256=entry['sha256'], status='revalidated')
+
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status} downloading {url}")
+
+        return self._store(url, response.body, response.headers)
+
+    def _download(self, client: HttpClient, url: str) -> CachedDownload:
+        response = client.get(url)
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status} downloading {url}")
+        return self._store(url, response.body, response.headers)
+
+    def _store(self, url: str, body: bytes, headers: Dict[str, str]) -> CachedDownload:
+        sha256 = hashlib.sha256(body).hexdigest()
+        path = self._archive_path(sha256)
+
+        try:
+            os.utime(path)  # Already have it from another URL
+            status = 'deduplicated'
+        except FileNotFoundError:
+            self._write_atomic(path, body)
+            status = 'downloaded'
+
+        self._write_atomic(self._url_path(url), json.dumps({
+            'url': url,
+            'sha256': sha256,
+            'size': len(body),
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'fetched_at': time.time(),
+        }).encode())
+
+        self.record(status, len(body))
+        if status == 'downloaded':
+            self.evict(keep=path)
+
+        return CachedDownload(url=url, path=path, sha256=sha256, status=status)
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        evicted = super().evict(keep)
+
+        # Forget the URLs whose archives are gone, including any evicted by other processes
+        if evicted:
+            for entry in os.scandir(os.path.join(self.cache_dir, URL_DIR)):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    with open(entry.path, 'r') as fh:
+                        sha256 = json.load(fh)['sha256']
+                    if not os.path.exists(self._archive_path(sha256)):
+                        os.unlink(entry.path)
+                except (FileNotFoundError, ValueError, KeyError):
+                    pass
+
+        return evicted
+
+    def record(self, status: str, downloaded_bytes: int):
+        """ Adds a fetch to the stats file, which is shared by every user of the cache """
+        def update(stats: dict):
+            stats[status] = stats.get(status, 0) + 1
+            stats['bytes_downloaded'] = stats.get('bytes_downloaded', 0) + downloaded_bytes
+
+        self._update_stats(update)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        stats = self._read_stats()
+
+        fetches = sum(stats.get(s, 0) for s in ('downloaded', 'revalidated', 'deduplicated'))
+        sizes = self._entry_sizes()
+
+        return {
+            'downloaded': stats.get('downloaded', 0),
+            'revalidated': stats.get('revalidated', 0),
+            'deduplicated': stats.get('deduplicated', 0),
+            # Fetches that didn't need a new copy of the archive
+            'hit_rate': (fetches - stats.get('downloaded', 0)) / fetches if fetches else 0.0,
+            'bytes_downloaded': stats.get('bytes_downloaded', 0),
+            'archives': len(sizes),
+            'size_bytes': sum(sizes),
+        }
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Inspect or fill a download cache')
+    arg_parser.add_argument('command', choices=['stats', 'fetch'])
+    arg_parser.add_argument('cache_dir')
+    arg_parser.add_argument('url', nargs='?', help='The URL to fetch (fetch)')
+    args = arg_parser.parse_args()
+
+    if args.command == 'stats':
+        if not os.path.isdir(args.cache_dir):
+            sys.exit(f"No cache at {args.cache_dir}")
+        print(json.dumps(DownloadCache(args.cache_dir).stats(), indent=2))
+    else:
+        if not args.url:
+            sys.exit("fetch needs a URL")
+        with HttpClient() as client:
+            download = DownloadCache(args.cache_dir).fetch(client, args.url)
+        print(download.path)
+        print(download.status, file=sys.stderr)
@@ -1,16 +1,24 @@
-from collections import Counter
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
 import dataclasses
+import functools
+import hashlib
 from io import TextIOWrapper
 from pprint import pprint
-from typing import Dict, Set, Tuple, Optional, TypeVar, Generic
+from typing import IO, Callable, Dict, Iterable, Iterator, Set, Tuple, Optional, TypeVar, Generic, Union
 from zipfile import ZipFile
+import html
 import os
+import pickle
 import re
 import sys
+import threading
 
 from lxml import etree
 from inscriptis import get_text as html_to_text
 from models import *
+import instrumentation
 
 """
 Data model notes
@@ -31,6 +39,14 @@ FZ_RESOURCES_DB_PATH = '/home/troy/Downloads/fritzing-app/resources/parts/core'
 CORE_PARTS_DB_PATH = '/usr/share/fritzing/parts/core'
 # These are used in some online projects
 OBSOLETE_PARTS_DB_PATH = '/usr/share/fritzing/parts/obsolete'
+# In load order; see list_core_part_files
+CORE_PART_DIRS = [FZ_RESOURCES_DB_PATH, CORE_PARTS_DB_PATH, OBSOLETE_PARTS_DB_PATH]
+
+# Parsed core parts are cached here between runs, see load_core_parts
+PARTS_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'circuit-describer', 'parts_bin.pickle')
+# Bump this whenever parse_part_file or the FzPart/Part models change so stale cache
+# files get thrown away instead of unpickled into the wrong shape
+PARSER_VERSION = 3
 
 
 T = TypeVar('T')
@@ -40,25 +56,72 @@ class SuffixMatcher(Generic[T]):
     the entry whose key is the longest suffix match to the module ID.
     """
 
-    _entries: List[Tuple[str, T]]
+    # Keys starting with ^ must match the whole module ID
+    _exact: Dict[str, T]
+    # A trie of the other keys, reversed. Each node maps the next character to a child node,
+    # and a node with an entry for the key None is the end of a key with that value.
+    _reversed_trie: dict
+    # Results of previous lookups, since the same few module IDs come up over and over.
+    # Cleared if it gets big, since module IDs come from sketches (e.g. uploads to the server).
+    _memo: Dict[str, Tuple[bool, Optional[T]]]
+
+    MAX_MEMO_SIZE = 4096
 
     def __init__(self, elems: Dict[str, T]):
-        keys = list(elems.keys())
+        self._exact = {}
+        self._reversed_trie = {}
+        self._memo = {}
 
-        # Make longest prefix match first
-        keys.sort(key=lambda k: len(k), reverse=True)
+        for k, v in elems.items():
+            if k[0] == '^':  # Special syntax for exact match
+                self._exact[k[1:]] = v
+                continue
 
-        self._entries = [(k, elems[k]) for k in keys]
+            node = self._reversed_trie
+            for c in reversed(k):
+                node = node.setdefault(c, {})
+            node[None] = v
 
     def lookup(self, module_id: str, default: T):
-        # TODO use a trie or something to make this more efficient
-        for k, v in self._entries:
-            if k[0] == '^' and k[1:] == module_id:  # Special syntax for exact match
-                return v
-
-            if module_id.endswith(k):
-                return v
-        return default
+        memoized = self._memo.get(module_id)
+        if memoized is None:
+            if len(self._memo) >= self.MAX_MEMO_SIZE:
+                self._memo.clear()
+            memoized = self._memo[module_id] = self._find(module_id)
+
+        found, value = memoized
+        return value if found else default
+
+    def _find(self, module_id: str) -> Tuple[bool, Optional[T]]:
+        # An exact match always wins since no longer suffix can match the same ID
+        if module_id in self._exact:
+            return True, self._exact[module_id]
+
+        # Walk back from the end of the ID, remembering the deepest (i.e. longest) key seen
+        result = (False, None)
+        node = self._reversed_trie
+        for c in reversed(module_id):
+            node = node.get(c)
+            if node is None:
+                break
+            if None in node:
+                result = (True, node[None])
+        return result
+
+    def items(self) -> List[Tuple[str, T]]:
+        """ Returns the keys and values this was constructed with, in no particular order """
+        result = [('^' + k, v) for k, v in self._exact.items()]
+
+        stack = [('', self._reversed_trie)]
+        while stack:
+            suffix, node = stack.pop()
+            for c, child in node.items():
+                if c is None:
+                    result.append((suffix, child))
+                else:
+                    stack.append((c + suffix, child))
+
+        return result
 
 
 class SuffixSet(SuffixMatcher[bool]):
@@ -86,8 +149,66 @@ class TemplatedPartFamily:
     # property name, since group names can't contain spaces.
     id_match_pattern: str
 
+    @functools.cached_property
+    def id_match_regex(self) -> re.Pattern:
+        return re.compile(self.id_match_pattern)
+
     def matches(self, module_id: str):
-        return re.compile(self.id_match_pattern).match(module_id)
+        return self.id_match_regex.match(module_id)
+
+
+class TemplatedPartMatcher:
+    """
+    Finds the templated part family for a module ID, and the property values captured from it,
+    with a single regex that combines the families' patterns in order. The first family that
+    matches wins, the same as trying them one by one.
+    """
+
+    _families: List[TemplatedPartFamily]
+    # Each family's pattern is wrapped in a group named f<index>, and its own groups are
+    # renamed to f<index>_<name> since group names have to be unique across the whole regex
+    _regex: re.Pattern
+    # For each family, its renamed groups and the property names they capture
+    _family_groups: List[List[Tuple[str, str]]]
+    # Results of previous lookups; cleared if it gets big, since module IDs come from sketches
+    _memo: Dict[str, Optional[Tuple[TemplatedPartFamily, Dict[str, str]]]]
+
+    MAX_MEMO_SIZE = 4096
+
+    def __init__(self, families: List[TemplatedPartFamily]):
+        self._families = list(families)
+        self._memo = {}
+
+        alternatives = []
+        self._family_groups = []
+        for i, family in enumerate(self._families):
+            pattern = re.sub(r'\(\?P<(\w+)>', rf'(?P<f{i}_\1>', family.id_match_pattern)
+            alternatives.append(f"(?P<f{i}>{pattern})")
+            self._family_groups.append([
+                (f"f{i}_{name}", name.replace('_', ' ')) for name in family.id_match_regex.groupindex
+            ])
+        self._regex = re.compile('|'.join(alternatives))
+
+    def lookup(self, module_id: str) -> Optional[Tuple[TemplatedPartFamily, Dict[str, str]]]:
+        """ Returns the family and the properties captured from the module ID, or None if no family matches """
+        if module_id in self._memo:
+            return self._memo[module_id]
+
+        if len(self._memo) >= self.MAX_MEMO_SIZE:
+            self._memo.clear()
+
+        result = self._memo[module_id] = self._find(module_id)
+        return result
+
+    def _find(self, module_id: str) -> Optional[Tuple[TemplatedPartFamily, Dict[str, str]]]:
+        match = self._regex.match(module_id)
+        if match is None:
+            return None
+
+        # The family's group encloses all of its other groups, so it's the last one to close
+        index = int(match.lastgroup[1:])
+        id_props = {prop: match.group(group) for group, prop in self._family_groups[index]}
+        return self._families[index], id_props
 
 # These are module IDs for core parts that aren't fully specified by their part bin
 # description, and instead can be manually parameterized in the UI.
@@ -199,6 +320,8 @@ TEMPLATED_PART_FAMILIES = [
     ),
 ]
 
+TEMPLATED_PARTS = TemplatedPartMatcher(TEMPLATED_PART_FAMILIES)
+
 
 # This is a list of properties to show in the description of a part even if the part
 # does not have showInLabel=true for these props; all lowercase
@@ -216,9 +339,94 @@ class FzPart(Part):
     properties: Dict[str, str]
     display_properties: List[str]   # Props with showInLabel in part definition; in order; all lowercase
 
-PartsBin = Dict[str, FzPart]
+class PartsBin(MutableMapping):
+    """
+    Maps module IDs to parts, like a dict. Parts can also be registered by the path of their
+    part file with add_path, in which case the file is only parsed the first time the part is
+    looked up. Most sketches only use a few dozen of the thousands of core parts.
+
+    A bin can be layered on top of a base bin (see overlay). Lookups fall through to the base,
+    but writes only ever go to the top layer, so the base can be shared between sketches and
+    threads without any of them seeing each other's custom parts.
+    """
+
+    _parts: Dict[PartID, FzPart]
+    _paths: Dict[PartID, str]  # Parts that haven't been parsed yet
+    _base: Optional['PartsBin']
+    _parse_lock: threading.Lock
+    # Identifies the part files a core bin was loaded from (see load_core_parts), so results
+    # derived from it can be invalidated when the parts change. None if unknown.
+    fingerprint: Optional[str]
+
+    def __init__(self, base: Optional['PartsBin'] = None):
+        self._parts = {}
+        self._paths = {}
+        self._base = base
+        self._parse_lock = threading.Lock()
+        self.fingerprint = None
+
+    def overlay(self) -> 'PartsBin':
+        """ Returns an empty layer on top of this bin; this bin is never modified through it """
+        return PartsBin(base=self)
+
+    def add_path(self, module_id: PartID, path: str):
+        self._parts.pop(module_id, None)
+        self._paths[module_id] = path
+
+    def __getitem__(self, module_id: PartID) -> FzPart:
+        part = self._parts.get(module_id)
+        if part is not None:
+            return part
+
+        if module_id not in self._paths:
+            # Another thread may have parsed it since we looked. Parts are added to _parts
+            # before they're removed from _paths, so a second look at _parts can't miss it.
+            part = self._parts.get(module_id)
+            if part is not None:
+                return part
+            if self._base is None:
+                raise KeyError(module_id)
+            return self._base[module_id]
+
+        # Only one thread should parse a given part and update the dicts
+        with self._parse_lock:
+            part = self._parts.get(module_id)
+            if part is None:
+                part = parse_part_path(self._paths[module_id])
+                self._parts[module_id] = part
+                del self._paths[module_id]
+
+        return part
+
+    def __setitem__(self, module_id: PartID, part: FzPart):
+        self._paths.pop(module_id, None)
+        self._parts[module_id] = part
+
+    def __delitem__(self, module_id: PartID):
+        # Note: this can only remove parts from the top layer
+        if module_id in self._parts:
+            del self._parts[module_id]
+        else:
+            del self._paths[module_id]
+
+    def __contains__(self, module_id: object) -> bool:
+        # _paths first, for the same reason as in __getitem__
+        return module_id in self._paths or module_id in self._parts \
+            or (self._base is not None and module_id in self._base)
+
+    def __iter__(self) -> Iterator[PartID]:
+        yield from self._parts
+        yield from self._paths
+        if self._base is not None:
+            yield from (k for k in self._base if k not in self._parts and k not in self._paths)
+
+    def __len__(self) -> int:
+        if self._base is None:
+            return len(self._parts) + len(self._paths)
+        return sum(1 for _ in self)
 
-@dataclass(frozen=True, order=True)
+
+@dataclass(frozen=True, order=True, slots=True)
 class PinRef:
     part_instance_id: PartInstanceID
     pin_id: PinID
@@ -255,6 +463,61 @@ def format_parenthetical_props(prop_values: Dict[str, str], display_properties:
         return ''
 
 
+class PartCache:
+    """
+    A bounded LRU cache for generated parts. Sketches are mostly made of the same few
+    resistors, capacitors and LEDs, so most instances can share a previously built part.
+    """
+
+    max_size: int
+    hits: int
+    misses: int
+    _entries: 'OrderedDict[tuple, Tuple[object, Part]]'
+    _lock: threading.Lock
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key: tuple, create: Callable[[], Part], source: object = None) -> Part:
+        """
+        Returns the cached part for key, or creates and caches it. `source` is the object the
+        part was derived from; a cached part derived from a different object is replaced.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is source:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        part = create()
+
+        with self._lock:
+            self._entries[key] = (source, part)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return part
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+GENERATED_PART_CACHE = PartCache(max_size=4096)
+
+
 def create_factory_part(
     parts_bin: PartsBin,
     module_id: str,
@@ -262,6 +525,20 @@ def create_factory_part(
 ) -> Part:
     parent_part = parts_bin[module_id]
 
+    # A sketch can bundle its own version of a core part, so the parent is checked too
+    key = ('factory', module_id, frozenset(props.items()))
+    return GENERATED_PART_CACHE.get_or_create(
+        key,
+        lambda: build_factory_part(parent_part, module_id, props),
+        source=parent_part,
+    )
+
+
+def build_factory_part(
+    parent_part: FzPart,
+    module_id: str,
+    props: Dict[str, str]
+) -> Part:
     # Merge parent and child properties
     new_props = dict(parent_part.properties)
     new_props.update(props)
@@ -273,7 +550,7 @@ def create_factory_part(
     desc = FACTORY_PART_LONG_DESCRIPTION_OVERRIDES.lookup(module_id, parent_part.description)
 
     new_part = dataclasses.replace(
-        parts_bin[module_id],
+        parent_part,
         short_name=new_short_name,
         description=FACTORY_PART_LONG_DESCRIPTION_OVERRIDES.lookup(module_id, parent_part.description),
         part_id=create_factory_part_id(module_id, new_props),
@@ -288,16 +565,27 @@ def create_factory_part(
 def create_templated_part(
     family_spec: TemplatedPartFamily,
     module_id: str,
+    id_props: Dict[str, str],
+    props: Dict[str, str],
+) -> Part:
+    # id_props are determined by the module ID, so they don't need to be in the key
+    key = ('templated', module_id, frozenset(props.items()))
+    return GENERATED_PART_CACHE.get_or_create(
+        key,
+        lambda: build_templated_part(family_spec, module_id, id_props, props),
+    )
+
+
+def build_templated_part(
+    family_spec: TemplatedPartFamily,
+    module_id: str,
+    id_props: Dict[str, str],
     props: Dict[str, str],
 ) -> Part:
+    """ id_props are the properties captured from the module ID; see TemplatedPartMatcher """
     # If you think this is bad you should see how Fritzing does the same thing but in
     # dozens of lines of code :)
-    combined_props = {
-        k.replace('_', ' '): v
-        for k, v in
-            re.compile(family_spec.id_match_pattern).match(module_id).groupdict().items()
-    }
-
+    combined_props = dict(id_props)
     combined_props.update(props)
 
     # We create a new module ID here. Why? Mainly because some parts can have a "chip label"
@@ -330,6 +618,15 @@ def create_templated_part(
     )
 
 
+def intern_attr(elem: etree._Element, name: str) -> Optional[str]:
+    """
+    Gets an attribute as an interned string. Used for IDs that get repeated across lots of
+    PinRefs and pins, so they share one string instead of each having a copy.
+    """
+    value = elem.get(name)
+    return None if value is None else sys.intern(value)
+
+
 def clean_pin_name(name: str):
     name = name.strip()
     name = re.sub(r'^pin(\d)', r'\1', name, flags=re.IGNORECASE)
@@ -383,7 +680,7 @@ def parse_part_file(fh: TextIOWrapper) -> FzPart:
     pins: Dict[PinID, PartPin] = {}
 
     for connector_tag in module_tag.findall('./connectors/connector'):
-        pid = connector_tag.get('id')
+        pid = intern_attr(connector_tag, 'id')
         pin_short_name = clean_pin_name(connector_tag.get('name'))
 
         pin_desc_tag = connector_tag.find('./description')
@@ -411,78 +708,227 @@ def sort_adj(a, b):
         return b, a
 
 
-def parse_schematic(parts_bin: PartsBin, fh: TextIOWrapper) -> Schematic:
-    xml_doc = etree.parse(fh)
+class DisjointSet(Generic[T]):
+    """ Union-find over hashable items, with path compression and union by size """
 
-    # First we list the wires. They're redundant for nodes in the schematic so we want to ignore them when producing
-    # the final result. Another thing these all have in common is their one pin called "common".
-    connector_instance_ids: Set[str] = set([
-        e.get('modelIndex') for e in
-            # Note: lxml's xpath doesn't support selecting attribute values directly, only nodes
-            xml_doc.findall(f"./instances/instance")
-            if e.get('moduleIdRef') in [NET_LABEL_MODULE_ID, WIRE_MODULE_ID, GROUND_MODULE_ID]
-    ])
-    net_labels: Dict[str, str] = {}  # Maps net label node instance IDs to the net's name
+    _parents: Dict[T, T]
+    _sizes: Dict[T, int]
 
-    schematic = Schematic()
-    adjacencies: Set[Tuple[PinRef, PinRef]] = set()
-    designator_counts = Counter()
+    def __init__(self):
+        self._parents = {}
+        self._sizes = {}
 
-    # Pre-populate a ground node and net
-    net_labels[GROUND_PART_INSTANCE.part_instance_id] = GROUND_PART.short_name
-    schematic.part_instances_by_id[GROUND_PART_INSTANCE.part_instance_id] = GROUND_PART_INSTANCE
+    def find(self, item: T) -> T:
+        parents = self._parents
+        if item not in parents:
+            parents[item] = item
+            self._sizes[item] = 1
+            return item
 
-    for instance in xml_doc.findall('./instances/instance'):
-        module_id_ref = instance.get('moduleIdRef')
-        is_net_label = module_id_ref == NET_LABEL_MODULE_ID
-        is_wire = module_id_ref == WIRE_MODULE_ID
-        is_ground = module_id_ref == GROUND_MODULE_ID
+        root = item
+        while parents[root] != root:
+            root = parents[root]
+
+        # Point everything on the path straight at the root so later finds are quick
+        while item != root:
+            parents[item], item = root, parents[item]
 
-        schematic_view = instance.find('./views/schematicView')
-        if schematic_view is None or schematic_view.get('layer') not in SCHEMATIC_LAYERS:  # This could be a PCB or breadboard-only symbol
+        return root
+
+    def union(self, a: T, b: T):
+        root_a = self.find(a)
+        root_b = self.find(b)
+        if root_a == root_b:
+            return
+
+        if self._sizes[root_a] < self._sizes[root_b]:
+            root_a, root_b = root_b, root_a
+
+        self._parents[root_b] = root_a
+        self._sizes[root_a] += self._sizes[root_b]
+
+    def groups(self) -> List[List[T]]:
+        groups_by_root: Dict[T, List[T]] = {}
+        for item in self._parents:
+            groups_by_root.setdefault(self.find(item), []).append(item)
+        return list(groups_by_root.values())
+
+
+def build_nets(adjacencies: Set[Tuple[PinRef, PinRef]]) -> List[List[PinRef]]:
+    """
+    Groups the pins in adjacencies into nets of transitively connected pins.
+    Each net is sorted, and the nets are ordered by their lowest PinRef.
+    """
+    nets: DisjointSet[PinRef] = DisjointSet()
+    for a, b in adjacencies:
+        nets.union(a, b)
+
+    # Nets are disjoint, so comparing the sorted lists only ever looks at their first elements
+    return sorted(sorted(net) for net in nets.groups())
+
+
+# Views we never look at. In streaming mode these are thrown away as soon as they've been read.
+NON_SCHEMATIC_VIEW_TAGS = ('breadboardView', 'pcbView', 'iconView')
+
+
+def iter_instances(fh: TextIOWrapper, streaming: bool = False) -> Iterator[etree._Element]:
+    """
+    Yields the <instance> elements of a .fz document in document order.
+
+    With streaming=True the document is never held in memory all at once: each instance is
+    freed after the caller is done with it, and non-schematic views are freed as they're read.
+    The caller must not hold on to the yielded elements.
+    """
+    if not streaming:
+        yield from etree.parse(fh).findall('./instances/instance')
+        return
+
+    for _, elem in etree.iterparse(fh, events=('end',), tag=('instance',) + NON_SCHEMATIC_VIEW_TAGS):
+        if elem.tag != 'instance':
+            elem.clear()
             continue
 
-        instance_id = instance.get('modelIndex')
+        # Only top level instances (i.e. /module/instances/instance) are parts of the sketch
+        parent = elem.getparent()
+        if parent is None or parent.tag != 'instances' or parent.getparent() is None \
+                or parent.getparent().getparent() is not None:
+            continue
 
-        has_connection = False
+        yield elem
+
+        elem.clear(keep_tail=True)
+        # Also drop the now empty elements for earlier instances
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+@dataclass
+class InstanceRecord:
+    """ Everything we need from one <instance> element of a .fz file """
+    instance_id: PartInstanceID
+    module_id: str
+    in_schematic: bool  # False for PCB or breadboard-only symbols, which we otherwise ignore
+    properties: Dict[str, str]
+    # Connections as they appear in the file, each pair sorted (see build_schematic)
+    adjacencies: List[Tuple[PinRef, PinRef]]
+    has_connection: bool
 
-        # Find all the connections and put them in the adjacency list
-        for connector in schematic_view.findall('./connectors/connector'):
-            if connector.get('layer') not in SCHEMATIC_LAYERS:
+
+def is_connector_module(module_id: str) -> bool:
+    """ Wires, net labels and grounds just connect other parts and aren't parts themselves """
+    return module_id in (WIRE_MODULE_ID, NET_LABEL_MODULE_ID, GROUND_MODULE_ID)
+
+
+def read_instance(instance: etree._Element) -> InstanceRecord:
+    module_id_ref = instance.get('moduleIdRef')
+    instance_id = intern_attr(instance, 'modelIndex')
+
+    schematic_view = instance.find('./views/schematicView')
+    if schematic_view is None or schematic_view.get('layer') not in SCHEMATIC_LAYERS:  # This could be a PCB or breadboard-only symbol
+        return InstanceRecord(
+            instance_id=instance_id,
+            module_id=module_id_ref,
+            in_schematic=False,
+            properties={},
+            adjacencies=[],
+            has_connection=False,
+        )
+
+    has_connection = False
+    adjacencies: List[Tuple[PinRef, PinRef]] = []
+
+    # Find all the connections and put them in the adjacency list
+    for connector in schematic_view.findall('./connectors/connector'):
+        if connector.get('layer') not in SCHEMATIC_LAYERS:
+            continue # TODO test
+
+        # Treat all endpoints of a wire as the same node so they end up adjacent
+        if is_connector_module(module_id_ref):
+            pin_id = 'common'
+        else:
+            pin_id = intern_attr(connector, 'connectorId')
+
+        this_pin_ref = PinRef(
+            part_instance_id=instance_id,
+            pin_id=pin_id,
+        )
+
+        for connect2 in connector.findall('./connects/connect'):
+            if connect2.get('layer') not in SCHEMATIC_LAYERS:
                 continue # TODO test
 
-            # Treat all endpoints of a wire as the same node so they end up adjacent
-            if is_wire or is_net_label or is_ground:
-                pin_id = 'common'
-            else:
-                pin_id = connector.get('connectorId')
+            has_connection = True
+            c2_part_inst = intern_attr(connect2, 'modelIndex')
+            c2_conn_id = intern_attr(connect2, 'connectorId')
 
-            this_pin_ref = PinRef(
-                part_instance_id=instance_id,
-                pin_id=pin_id,
-            )
+            other_pin_ref = PinRef(part_instance_id=c2_part_inst, pin_id=c2_conn_id)
+
+            # We add these always in a sorted order since they're non-directional
+            adjacencies.append(sort_adj(this_pin_ref, other_pin_ref))
+
+    # Extract the property key-value pairs
+    properties: Dict[str, str] = {
+        prop_tag.get('name').lower(): prop_tag.get('value')
+        for prop_tag in instance.findall("./property") or []
+    }
+
+    return InstanceRecord(
+        instance_id=instance_id,
+        module_id=module_id_ref,
+        in_schematic=True,
+        properties=properties,
+        adjacencies=adjacencies,
+        has_connection=has_connection,
+    )
+
+
+def parse_schematic(parts_bin: PartsBin, fh: TextIOWrapper, streaming: bool = False) -> Schematic:
+    records = (read_instance(e) for e in iter_instances(fh, streaming))
+    return build_schematic(parts_bin, instrumentation.timed_iter(records, 'read_instances'))
 
-            for connect2 in connector.findall('./connects/connect'):
-                if connect2.get('layer') not in SCHEMATIC_LAYERS:
-                    continue # TODO test
 
-                has_connection = True
-                c2_part_inst = connect2.get('modelIndex')
-                c2_conn_id = connect2.get('connectorId')
+@instrumentation.stage('instance_loop')
+def build_schematic(
+    parts_bin: PartsBin,
+    records: Iterable[InstanceRecord],
+    net_builder: Optional[Callable[[Set[Tuple[PinRef, PinRef]]], List[List[PinRef]]]] = None,
+) -> Schematic:
+    """
+    Builds a schematic from the sketch's instances, in document order. net_builder replaces
+    build_nets, e.g. to reuse the nets of an earlier version of the sketch.
+    """
+    # We keep track of the wires. They're redundant for nodes in the schematic so we want to ignore them when producing
+    # the final result. Another thing these all have in common is their one pin called "common".
+    connector_instance_ids: Set[str] = set()
+    net_labels: Dict[str, str] = {}  # Maps net label node instance IDs to the net's name
 
-                if c2_part_inst in connector_instance_ids:
-                    c2_conn_id = 'common'
+    schematic = Schematic()
+    # Adjacencies as they appear in the file. An instance can connect to a wire that comes later
+    # in the file, so these get normalized to the wires' common pins once we've seen everything.
+    raw_adjacencies: Set[Tuple[PinRef, PinRef]] = set()
+    designator_counts = Counter()
 
-                other_pin_ref = PinRef(part_instance_id=c2_part_inst, pin_id=c2_conn_id)
+    # Pre-populate a ground node and net
+    net_labels[GROUND_PART_INSTANCE.part_instance_id] = GROUND_PART.short_name
+    schematic.part_instances_by_id[GROUND_PART_INSTANCE.part_instance_id] = GROUND_PART_INSTANCE
 
-                # We add these always in a sorted order since they're non-directional
-                adjacencies.add(sort_adj(this_pin_ref, other_pin_ref))
+    instance_count = 0
+    for record in records:
+        instance_count += 1
+        module_id_ref = record.module_id
+        is_net_label = module_id_ref == NET_LABEL_MODULE_ID
+        is_wire = module_id_ref == WIRE_MODULE_ID
+        is_ground = module_id_ref == GROUND_MODULE_ID
+
+        if is_wire or is_net_label or is_ground:
+            connector_instance_ids.add(record.instance_id)
 
-        # Extract the property key-value pairs
-        properties: Dict[str, str] = {
-            prop_tag.get('name').lower(): prop_tag.get('value')
-            for prop_tag in instance.findall("./property") or []
-        }
+        if not record.in_schematic:
+            continue
+
+        instance_id = record.instance_id
+        properties = record.properties
+        raw_adjacencies.update(record.adjacencies)
 
         if is_ground:
             # All grounds are connected to the same singleton ground part, and then the parts
@@ -498,10 +944,10 @@ def parse_schematic(parts_bin: PartsBin, fh: TextIOWrapper) -> Schematic:
                 pin_id=list(GROUND_PART.pins.keys())[0],
             )
 
-            adjacencies.add(sort_adj(schematic_pin_ref, implicit_ground_net_ref))
+            raw_adjacencies.add(sort_adj(schematic_pin_ref, implicit_ground_net_ref))
 
             # Note: The original ground symbol is marked as a connector already
-            # (see construction of connector_instance_ids) so it will not be displayed
+            # (see the top of the loop) so it will not be displayed
             # as its own part and will be traversed in the net coalescing step
 
         elif is_net_label:
@@ -523,11 +969,11 @@ def parse_schematic(parts_bin: PartsBin, fh: TextIOWrapper) -> Schematic:
                 pin_id='common',
             )
 
-            adjacencies.add(sort_adj(schematic_pin_ref, implicit_net_ref))
+            raw_adjacencies.add(sort_adj(schematic_pin_ref, implicit_net_ref))
 
             # Treat this fake net node as a wire
             # (note that the net node from the FZ file will already be marked as a wire
-            # when we initialized connector_instance_ids above)
+            # at the top of the loop)
             connector_instance_ids.add(net_node_instance_id)
 
             # Record the label for later
@@ -544,14 +990,13 @@ def parse_schematic(parts_bin: PartsBin, fh: TextIOWrapper) -> Schematic:
             part = parts_bin[module_id_ref]
         else:
             # Look for a templated part
-            for family_spec in TEMPLATED_PART_FAMILIES:
-                if family_spec.matches(module_id_ref):
-                    part = create_templated_part(family_spec, module_id_ref, properties)
-                    break
-
-            if part is None:
+            templated = TEMPLATED_PARTS.lookup(module_id_ref)
+            if templated is None:
                 raise RuntimeError(f"No spec found for part with ID {module_id_ref}")
 
+            family_spec, id_props = templated
+            part = create_templated_part(family_spec, module_id_ref, id_props, properties)
+
         designator_counts[part.designator_prefix] += 1
 
         part_instance = PartInstance(
@@ -560,46 +1005,31 @@ def parse_schematic(parts_bin: PartsBin, fh: TextIOWrapper) -> Schematic:
             designator=part.designator_prefix + str(designator_counts[part.designator_prefix])
         )
 
-        if has_connection:
+        if record.has_connection:
             schematic.part_instances_by_id[instance_id] = part_instance
             # Note: unconnected part will still take a designator slot for now
 
-    # Traverse all the adjacencies to build the nets
-    nets: List[Set[PinRef]] = [set([p]) for p in sorted(set([  # Start with each PinRef in its own set
-        p
-        for adj in adjacencies
-        for p in adj
-    ]))]
-
-    while True:
-        merged_something = False
-        i = 0
-        while i < len(nets) - 1:
-            nets_to_merge = set()
-            for p in nets[i]:
-                for j in range(i + 1, len(nets)):
-                    net2 = nets[j]
-                    for q in nets[j]:
-                        if sort_adj(p, q) in adjacencies:
-                            nets_to_merge.add(j)
-                            break
-
-            for j in nets_to_merge:
-                nets[i] = nets[i].union(nets[j])
-
-            # Do this in a separate loop so we don't mess up indices
-            nets = [n for j, n in enumerate(nets) if j not in nets_to_merge]
-
-            if nets_to_merge:
-                merged_something = True
-
-            i += 1
-
-        if not merged_something:
-            break
-
-    for i, net in enumerate(sorted(nets)):
-        sorted_net = sorted(net)
+    def common_pin(p: PinRef) -> PinRef:
+        if p.part_instance_id in connector_instance_ids:
+            return PinRef(part_instance_id=p.part_instance_id, pin_id='common')
+        return p
+
+    with instrumentation.stage('net_merge'):
+        adjacencies: Set[Tuple[PinRef, PinRef]] = set(
+            sort_adj(common_pin(a), common_pin(b)) for a, b in raw_adjacencies
+        )
+
+        # Traverse all the adjacencies to build the nets
+        nets = (net_builder or build_nets)(adjacencies)
+
+    instrumentation.count('instances', instance_count)
+    instrumentation.count('part_instances', len(schematic.part_instances_by_id))
+    instrumentation.count('adjacencies', len(adjacencies))
+    instrumentation.count('nets', len(nets))
+    # Each union that joins two nets is one merge
+    instrumentation.count('net_merges', sum(len(net) for net in nets) - len(nets))
+
+    for i, sorted_net in enumerate(nets):
         connections = [
             Connection(
                 part_instance=schematic.part_instances_by_id[p.part_instance_id],
@@ -627,40 +1057,193 @@ def parse_schematic(parts_bin: PartsBin, fh: TextIOWrapper) -> Schematic:
     return schematic
 
 
-def load_core_parts() -> PartsBin:
-    parts_bin: PartsBin = {}
+# Maps a part file path to the (mtime_ns, size) it had when it was read, its module ID,
+# and the parsed part (None if the file was only indexed, see load_core_parts)
+PartsCacheEntries = Dict[str, Tuple[int, int, PartID, Optional[FzPart]]]
+
+# The module ID attribute is on the root tag, which is normally in the first few hundred bytes
+MODULE_ID_ATTR_RE = re.compile(rb'<module\b[^>]*?\bmoduleId\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+MODULE_ID_SCAN_BYTES = 4096
+
+
+def read_parts_cache(cache_path: str) -> PartsCacheEntries:
+    """
+    Returns the cached entries, or an empty dict if the cache is missing, unreadable,
+    or was written by a different PARSER_VERSION.
+    """
+    try:
+        with open(cache_path, 'rb') as fh:
+            cache = pickle.load(fh)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return {}
+
+    if not isinstance(cache, dict) or cache.get('version') != PARSER_VERSION:
+        return {}
+
+    return cache['entries']
+
+
+def write_parts_cache(cache_path: str, entries: PartsCacheEntries):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    # Write to a temp file and rename so a concurrent reader never sees a partial cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as fh:
+        pickle.dump({'version': PARSER_VERSION, 'entries': entries}, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
 
-    for dir_path in [FZ_RESOURCES_DB_PATH, CORE_PARTS_DB_PATH, OBSOLETE_PARTS_DB_PATH]:
+
+def list_core_part_files(dirs: Optional[List[str]] = None) -> List[str]:
+    """
+    Returns the paths of all core part files in dirs (default CORE_PART_DIRS), in the order
+    they should be loaded (later files win when two of them define the same module ID).
+    """
+    paths = []
+    for dir_path in CORE_PART_DIRS if dirs is None else dirs:
         for filename in os.listdir(dir_path):
             if not filename.endswith(PART_EXTENSION):
                 continue
 
-            f = os.path.join(dir_path, filename)
+            paths.append(os.path.join(dir_path, filename))
+
+    return paths
+
+
+def parse_part_path(path: str) -> FzPart:
+    with open(path, 'r') as fh:
+        return parse_part_file(fh)
+
+
+def scan_module_id(path: str) -> Optional[PartID]:
+    """
+    Finds a part file's module ID without parsing it. Returns None if it can't be found,
+    in which case the file should be fully parsed instead.
+    """
+    with open(path, 'rb') as fh:
+        head = fh.read(MODULE_ID_SCAN_BYTES)
+        match = MODULE_ID_ATTR_RE.search(head)
+        if match is None:
+            match = MODULE_ID_ATTR_RE.search(head + fh.read())
+
+    if match is None:
+        return None
 
-            with open(f, 'r') as fh:
-                part = parse_part_file(fh)
-                parts_bin[part.part_id] = part
+    return html.unescape(match.group(1).decode('utf-8'))
+
+
+def parse_part_paths(paths: List[str], workers: int = 1) -> List[FzPart]:
+    """
+    Parses the given part files, in order. With workers > 1 the files are spread across
+    a process pool, which is only worth it when there are a lot of them.
+    """
+    if workers <= 1 or len(paths) < 2:
+        return [parse_part_path(p) for p in paths]
+
+    # A few chunks per worker keeps the pool busy without paying IPC per file
+    chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(parse_part_path, paths, chunksize=chunksize))
+
+
+@instrumentation.stage('load_core_parts')
+def load_core_parts(
+    cache_path: Optional[str] = PARTS_CACHE_PATH,
+    rebuild_cache: bool = False,
+    workers: int = 1,
+    lazy: bool = False,
+    dirs: Optional[List[str]] = None,
+) -> PartsBin:
+    """
+    Loads all the core parts. Parsed parts are cached in cache_path and only files whose
+    mtime or size changed since the last run are parsed again. Pass cache_path=None to
+    disable the cache, or rebuild_cache=True to ignore its current contents.
+
+    Files that need parsing are parsed across a pool of `workers` processes if more than one
+    is requested. The result is the same either way.
+
+    With lazy=True files that aren't already in the cache are only scanned for their module
+    ID, and each one is parsed the first time the returned bin is asked for that part.
+
+    dirs overrides CORE_PART_DIRS, e.g. to load a synthetic parts bin for benchmarking.
+    """
+    cached: PartsCacheEntries = {}
+    if cache_path is not None and not rebuild_cache:
+        cached = read_parts_cache(cache_path)
+
+    paths = list_core_part_files(dirs)
+
+    entries: PartsCacheEntries = {}
+    to_parse: List[str] = []
+    for f in paths:
+        st = os.stat(f)
+        entry = cached.get(f)
+
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size \
+                and (lazy or entry[3] is not None):
+            entries[f] = entry
+            continue
+
+        module_id = scan_module_id(f) if lazy else None
+        if module_id is None:
+            to_parse.append(f)
+            module_id = ''  # Filled in once parsed
+        entries[f] = (st.st_mtime_ns, st.st_size, module_id, None)
+
+    instrumentation.count('core_parts_parsed', len(to_parse))
+    for f, part in zip(to_parse, parse_part_paths(to_parse, workers)):
+        mtime_ns, size, _, _ = entries[f]
+        entries[f] = (mtime_ns, size, part.part_id, part)
+
+    # Merge in load order so later directories win on duplicate module IDs
+    parts_bin = PartsBin()
+    for f in paths:
+        _, _, module_id, part = entries[f]
+        if part is None:
+            parts_bin.add_path(module_id, f)
+        else:
+            parts_bin[module_id] = part
+
+    fingerprint = hashlib.sha256(f"parser {PARSER_VERSION}\n".encode())
+    for f in paths:
+        fingerprint.update(f"{f} {entries[f][0]} {entries[f][1]}\n".encode())
+    parts_bin.fingerprint = fingerprint.hexdigest()
+
+    # Also rewrite the cache if files were deleted since it was written
+    dirty = rebuild_cache or any(entries[f] is not cached.get(f) for f in paths) or len(entries) != len(cached)
+    if cache_path is not None and dirty:
+        write_parts_cache(cache_path, entries)
 
     return parts_bin
 
 
-# TODO make this take in a file handle?
-def parse_sketch(parts_bin: PartsBin, path: str) -> Schematic:
-    # Note: parts_bin gets mutated; I think that's OK for this use case
+def find_sketch_files(zf: ZipFile) -> Tuple[List[str], str]:
+    """ Returns the names of the bundled part files and of the .fz file in a .fzz archive """
+    fzp_files = [f for f in zf.namelist() if f.endswith(PART_EXTENSION)]
+    fz_files = [f for f in zf.namelist() if f.endswith('.fz')]
+
+    if len(fz_files) != 1:
+        raise RuntimeError("Unsupported number of .fz files in archive")
+
+    return fzp_files, fz_files[0]
 
-    with ZipFile(path, 'r') as zf:
-        fzp_files = [f for f in zf.namelist() if f.endswith(PART_EXTENSION)]
-        fz_files = [f for f in zf.namelist() if f.endswith('.fz')]
 
-        if len(fz_files) != 1:
-            raise RuntimeError("Unsupported number of .fz files in archive")
+def parse_sketch(parts_bin: PartsBin, path: Union[str, IO[bytes]], streaming: bool = False) -> Schematic:
+    """ Parses a .fzz archive, given either its path or a binary file object """
+    # Parts bundled with the sketch go in a layer of their own, so parts_bin isn't modified
+    # and can be reused for other sketches
+    parts_bin = parts_bin.overlay()
+
+    with ZipFile(path, 'r') as zf:
+        fzp_files, fz_file = find_sketch_files(zf)
 
         # Parse any non-core parts included in the package
-        for fzp_file in fzp_files:
-            with zf.open(fzp_file) as fh:
-                part = parse_part_file(fh)
-                parts_bin[part.part_id] = part
+        with instrumentation.stage('bundled_parts'):
+            for fzp_file in fzp_files:
+                with zf.open(fzp_file) as fh:
+                    part = parse_part_file(fh)
+                    parts_bin[part.part_id] = part
+        instrumentation.count('bundled_parts', len(fzp_files))
 
         # Parse the schematic file
-        with zf.open(fz_files[0]) as fh:
-            return parse_schematic(parts_bin, fh)
+        with zf.open(fz_file) as fh:
+            return parse_schematic(parts_bin, fh, streaming)
@@ -0,0 +1,143 @@
+# A small HTTP client that keeps connections open between requests, for scraping and
+# downloading many pages from the same few hosts. Only the standard library is needed.
+import gzip
+import http.client
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+USER_AGENT = 'circuit-describer/1.0'
+DEFAULT_TIMEOUT_S = 30
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+# (scheme, host, port)
+HostKey = Tuple[str, str, int]
+
+
+@dataclass
+class HttpResponse:
+    url: str  # After redirects
+    status: int
+    headers: Dict[str, str]  # Lowercase names
+    body: bytes
+
+    def text(self) -> str:
+        content_type = self.headers.get('content-type', '')
+        charset = 'utf-8'
+        if 'charset=' in content_type:
+            charset = content_type.split('charset=')[-1].split(';')[0].strip().strip('"')
+        return self.body.decode(charset, errors='replace')
+
+
+class HttpClient:
+    """
+    Keeps up to max_idle_per_host idle keep-alive connections per host and reuses them for
+    later requests. Safe to use from multiple threads; each request has a connection to
+    itself while it runs.
+    """
+
+    def __init__(self, max_idle_per_host: int = 8, timeout: float = DEFAULT_TIMEOUT_S):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle: Dict[HostKey, List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self.requests = 0
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+        """ GETs url, following redirects. Any status is returned rather than raised. """
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.request('GET', url, headers)
+            location = response.headers.get('location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                return response
+            url = urljoin(url, location)
+
+        raise RuntimeError(f"Too many redirects fetching {url}")
+
+    def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported URL {url}")
+
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        request_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip, deflate'}
+        request_headers.update(headers or {})
+
+        # A reused connection may have been closed by the server since, in which case the
+        # request fails straight away and is retried once on a new connection
+        for attempt in range(2):
+            conn, reused = self._checkout(key)
+            try:
+                conn.request(method, path, headers=request_headers)
+                raw = conn.getresponse()
+                body = raw.read()
+            except (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+
+            with self._lock:
+                self.requests += 1
+
+            response_headers = {k.lower(): v for k, v in raw.getheaders()}
+            if raw.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+
+            return HttpResponse(
+                url=url,
+                status=raw.status,
+                headers=response_headers,
+                body=decode_body(body, response_headers.get('content-encoding')),
+            )
+
+    def _checkout(self, key: HostKey) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+            self.connections_opened += 1
+
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout), False
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def _checkin(self, key: HostKey, conn: http.client.HTTPConnection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def __enter__(self) -> 'HttpClient':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def decode_body(body: bytes, content_encoding: Optional[str]) -> bytes:
+    if content_encoding == 'gzip':
+        return gzip.decompress(body)
+    if content_encoding == 'deflate':
+        return zlib.decompress(body)
+    return body
@@ -0,0 +1,228 @@
+# Re-describes a sketch as it's being edited. Only the instances that changed since the last
+# save are read again, the nets are only merged again if the connections changed, and only
+# the table rows that changed are rendered again. The whole .fz still has to be parsed and
+# the schematic rebuilt from it on each save, so the time per save still grows with the size
+# of the sketch, but it's a fraction of a full describe. Saves that don't change anything in
+# the schematic view (e.g. moving parts around the breadboard) skip everything after parsing.
+#
+# Usage: python incremental.py SKETCH.fzz OUT.html  (rewrites OUT.html whenever the sketch is saved)
+import argparse
+import hashlib
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import IO, Dict, List, Optional, Set, Tuple, Union
+from zipfile import ZipFile
+
+from lxml import etree
+
+from fritzing_parser import (
+    FzPart,
+    InstanceRecord,
+    PartsBin,
+    PinRef,
+    build_nets,
+    build_schematic,
+    find_sketch_files,
+    iter_instances,
+    load_core_parts,
+    parse_part_file,
+    read_instance,
+)
+from describer import RowCache, describe_as_html
+
+# How often to check the sketch for changes
+POLL_INTERVAL_S = 0.25
+
+
+@dataclass
+class UpdateStats:
+    added: int
+    changed: int
+    removed: int
+    unchanged: int
+    rows_rendered: int
+    rows_reused: int
+    # Nothing in the schematic changed, so the previous description was returned as is
+    reused: bool
+    seconds: float
+
+
+class IncrementalDescriber:
+    """
+    Describes successive versions of the same sketch, reusing what it can from the previous one.
+
+    Instances are matched up by modelIndex and compared by the content of their XML, then by
+    the record read from it if the XML changed. Nets are merged again from scratch if any
+    connection changed, since union-find can't undo a merge when a wire is removed.
+    """
+
+    parts_bin: PartsBin
+    last_update: Optional[UpdateStats]
+    # Instance records from the previous version by modelIndex, with a digest of their XML
+    _records: Dict[str, Tuple[bytes, InstanceRecord]]
+    # The modelIndexes of the previous version, in document order (designators depend on it)
+    _order: List[str]
+    # Bundled parts by file name and CRC, so unchanged ones aren't parsed again
+    _bundled_parts: Dict[Tuple[str, int], FzPart]
+    # The CRCs of the files in the previous version of the archive
+    _archive_crcs: Optional[Dict[str, int]]
+    # The previous version's net merging input and output
+    _adjacencies: Optional[Set[Tuple[PinRef, PinRef]]]
+    _nets: List[List[PinRef]]
+    _html: Optional[str]
+    _row_cache: RowCache
+
+    def __init__(self, parts_bin: PartsBin):
+        self.parts_bin = parts_bin
+        self.last_update = None
+        self._records = {}
+        self._order = []
+        self._bundled_parts = {}
+        self._archive_crcs = None
+        self._adjacencies = None
+        self._nets = []
+        self._html = None
+        self._row_cache = RowCache()
+
+    def update(self, path: Union[str, IO[bytes]]) -> str:
+        """ Returns the HTML description of the current version of the sketch """
+        start = time.perf_counter()
+        parts_bin = self.parts_bin.overlay()
+
+        with ZipFile(path, 'r') as zf:
+            archive_crcs = {info.filename: info.CRC for info in zf.infolist()}
+            if archive_crcs == self._archive_crcs:
+                # Saved again without changes
+                counts = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': len(self._records)}
+                return self._finish(start, counts, None)
+
+            fzp_files, fz_file = find_sketch_files(zf)
+
+            bundled_parts = {}
+            for fzp_file in fzp_files:
+                key = (fzp_file, zf.getinfo(fzp_file).CRC)
+                part = self._bundled_parts.get(key)
+                if part is None:
+                    with zf.open(fzp_file) as fh:
+                        part = parse_part_file(fh)
+
+                bundled_parts[key] = part
+                parts_bin[part.part_id] = part
+
+            bundled_changed = bundled_parts.keys() != self._bundled_parts.keys()
+
+            with zf.open(fz_file) as fh:
+                ordered, records, order, counts, records_changed = self._read_records(fh)
+
+        html = None
+        if bundled_changed or records_changed or self._html is None:
+            # Rendering can fail (e.g. on an unknown part), so nothing is kept from this version
+            # until it has succeeded. Otherwise a retry would match it and return stale HTML.
+            schematic = build_schematic(parts_bin, ordered, self._build_nets)
+            html = describe_as_html(schematic, self._row_cache)
+
+        self._archive_crcs = archive_crcs
+        self._bundled_parts = bundled_parts
+        self._records = records
+        self._order = order
+
+        return self._finish(start, counts, html)
+
+    def _finish(self, start: float, counts: Dict[str, int], html: Optional[str]) -> str:
+        """ Records the stats for an update that rendered html, or that reused the last one if None """
+        if html is not None:
+            self._html = html
+
+        self.last_update = UpdateStats(
+            **counts,
+            rows_rendered=self._row_cache.misses if html is not None else 0,
+            rows_reused=self._row_cache.hits if html is not None else 0,
+            reused=html is None,
+            seconds=time.perf_counter() - start,
+        )
+        return self._html
+
+    def _build_nets(self, adjacencies: Set[Tuple[PinRef, PinRef]]) -> List[List[PinRef]]:
+        if adjacencies != self._adjacencies:
+            self._adjacencies = adjacencies
+            self._nets = build_nets(adjacencies)
+        return self._nets
+
+    def _read_records(self, fh: IO[bytes]) -> Tuple[
+        List[InstanceRecord], Dict[str, Tuple[bytes, InstanceRecord]], List[str], Dict[str, int], bool
+    ]:
+        """
+        Returns the records in document order, the records and order to keep for the next
+        version, counts of how they changed, and whether the schematic built from them could
+        have changed. Instances only count as changed if the record read from them did.
+        """
+        records: Dict[str, Tuple[bytes, InstanceRecord]] = {}
+        ordered: List[InstanceRecord] = []
+        order: List[str] = []
+        counts = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+
+        for instance in iter_instances(fh, streaming=True):
+            model_index = instance.get('modelIndex')
+            digest = hashlib.sha1(etree.tostring(instance, with_tail=False)).digest()
+
+            previous = self._records.get(model_index)
+            if previous is not None and previous[0] == digest:
+                record = previous[1]
+                counts['unchanged'] += 1
+            else:
+                record = read_instance(instance)
+                if previous is None:
+                    counts['added'] += 1
+                elif record == previous[1]:  # Only other views or the geometry changed
+                    record = previous[1]
+                    counts['unchanged'] += 1
+                else:
+                    counts['changed'] += 1
+
+            records[model_index] = (digest, record)
+            ordered.append(record)
+            order.append(model_index)
+
+        counts['removed'] = len(self._records.keys() - records.keys())
+        # Designators are numbered in document order, so moving an instance matters too
+        records_changed = counts['added'] or counts['changed'] or counts['removed'] or order != self._order
+
+        return ordered, records, order, counts, bool(records_changed)
+
+
+def watch(sketch_path: str, out_path: str, describer: IncrementalDescriber):
+    last_mtime = None
+    while True:
+        try:
+            mtime = os.stat(sketch_path).st_mtime_ns
+        except FileNotFoundError:  # Some editors save by deleting and recreating the file
+            mtime = None
+
+        if mtime is not None and mtime != last_mtime:
+            last_mtime = mtime
+            try:
+                html = describer.update(sketch_path)
+            except Exception as e:  # Probably caught the file mid-save; try again next change
+                print(f"Could not describe {sketch_path}: {type(e).__name__}: {e}", file=sys.stderr)
+            else:
+                tmp_path = out_path + '.tmp'
+                with open(tmp_path, 'w') as fh:
+                    fh.write(html)
+                os.replace(tmp_path, out_path)
+                print(describer.last_update, file=sys.stderr)
+
+        time.sleep(POLL_INTERVAL_S)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Keep an HTML description of a sketch up to date as it is edited')
+    arg_parser.add_argument('sketch')
+    arg_parser.add_argument('out')
+    args = arg_parser.parse_args()
+
+    try:
+        watch(args.sketch, args.out, IncrementalDescriber(load_core_parts(lazy=True)))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,240 @@
+# Optional per-sketch tracing: how long each stage of the pipeline took, a few counters,
+# and optionally a profile, written as one JSON line per sketch for the metrics pipeline.
+#
+# Turned on with the environment variables below or the equivalent main.py/batch.py flags:
+#   CIRCUIT_DESCRIBER_TRACE=FILE          append a record per sketch to FILE ('-' for stderr)
+#   CIRCUIT_DESCRIBER_PROFILE=TOOL        also profile each sketch with cprofile or pyinstrument
+#   CIRCUIT_DESCRIBER_PROFILE_DIR=DIR     where profiles go (default: the current directory)
+# A bad value in the environment turns tracing off with a warning; a bad flag is an error.
+#
+# Stage times are exclusive: time spent in a stage nested in another (e.g. net_merge inside
+# instance_loop) only counts towards the inner one, so the stages add up to at most total_s.
+# When tracing is off, stage(), timed_iter() and count() do nothing, so they're left in the
+# pipeline for good.
+import argparse
+import contextlib
+import contextvars
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import warnings
+from typing import Dict, Iterable, Iterator, List, Optional, TypeVar
+
+try:
+    import pyinstrument
+except ImportError:  # Optional; only needed for --profile pyinstrument
+    pyinstrument = None
+
+TRACE_ENV = 'CIRCUIT_DESCRIBER_TRACE'
+PROFILE_ENV = 'CIRCUIT_DESCRIBER_PROFILE'
+PROFILE_DIR_ENV = 'CIRCUIT_DESCRIBER_PROFILE_DIR'
+
+PROFILERS = ['cprofile', 'pyinstrument']
+
+# Set by configure(); read from the environment on import
+trace_path: Optional[str] = None
+profiler: Optional[str] = None
+profile_dir: str = '.'
+
+_write_lock = threading.Lock()
+_profile_count = 0
+
+T = TypeVar('T')
+
+
+class Trace:
+    """ Stage timings and counters for one sketch """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        # Time spent in nested stages, for each stage we're currently in
+        self._child_times: List[float] = []
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('current_trace', default=None)
+
+
+def configure(trace: Optional[str] = None, profile: Optional[str] = None, profile_to: Optional[str] = None):
+    """ Turns tracing on (or off, if trace is None). Profiling needs tracing to be on. """
+    global trace_path, profiler, profile_dir
+
+    if profile is not None and profile not in PROFILERS:
+        raise ValueError(f"Unknown profiler {profile}; expected one of {', '.join(PROFILERS)}")
+    if profile == 'pyinstrument' and pyinstrument is None:
+        raise RuntimeError("Profiling with pyinstrument needs the pyinstrument package (pip install pyinstrument)")
+    if profile is not None and trace is None:
+        warnings.warn(f"Not profiling with {profile}: profiling needs tracing to be on too")
+        profile = None
+
+    trace_path = trace
+    profiler = profile
+    profile_dir = profile_to or '.'
+
+    if profile is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+
+
+def add_arguments(arg_parser: argparse.ArgumentParser):
+    """ Adds the --trace and --profile flags, which override the environment variables """
+    arg_parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        default=trace_path,
+        help=f"Append a JSON record of stage timings and counters per sketch to FILE ('-' for stderr; env {TRACE_ENV})",
+    )
+    arg_parser.add_argument(
+        '--profile',
+        choices=PROFILERS,
+        default=profiler,
+        help=f"Also profile each sketch (needs --trace; env {PROFILE_ENV})",
+    )
+    arg_parser.add_argument(
+        '--profile-dir',
+        default=profile_dir,
+        help=f"Where to write the profiles (env {PROFILE_DIR_ENV})",
+    )
+
+
+def configure_from_args(args: argparse.Namespace):
+    configure(trace=args.trace, profile=args.profile, profile_to=args.profile_dir)
+
+
+def is_enabled() -> bool:
+    return trace_path is not None
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Adds the time spent in the block, less any nested stages, to the current sketch's stage
+    `name`. Also works as a function decorator.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    trace._child_times.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        child_time = trace._child_times.pop()
+        trace.stages[name] = trace.stages.get(name, 0.0) + elapsed - child_time
+        if trace._child_times:
+            trace._child_times[-1] += elapsed
+
+
+def timed_iter(iterable: Iterable[T], name: str) -> Iterable[T]:
+    """ Counts the time spent producing each item of a lazy iterable as stage `name` """
+    if _current_trace.get() is None:
+        return iterable
+
+    def timed() -> Iterator[T]:
+        iterator = iter(iterable)
+        while True:
+            with stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    return timed()
+
+
+def count(name: str, n: int = 1):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + n
+
+
+def write_record(record: dict):
+    line = json.dumps(record) + '\n'
+    with _write_lock:
+        if trace_path == '-':
+            sys.stderr.write(line)
+            return
+
+        # One write per record, so records from several processes don't interleave
+        with open(trace_path, 'a') as fh:
+            fh.write(line)
+
+
+def _profile_path(name: str, extension: str) -> str:
+    global _profile_count
+    _profile_count += 1
+
+    stem = os.path.splitext(os.path.basename(name))[0] or 'sketch'
+    return os.path.join(profile_dir, f"{stem}-{os.getpid()}-{_profile_count}{extension}")
+
+
+@contextlib.contextmanager
+def trace_sketch(name: str) -> Iterator[Optional[Trace]]:
+    """
+    Traces everything in the block as the work for one sketch, and writes its record at the
+    end (even if the block raises). Yields None when tracing is off.
+    """
+    if not is_enabled():
+        yield None
+        return
+
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+
+    profile = None
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        profile.enable()
+    elif profiler == 'pyinstrument':
+        profile = pyinstrument.Profiler()
+        profile.start()
+
+    record = {'sketch': name, 'pid': os.getpid(), 'started_at': time.time()}
+    start = time.perf_counter()
+    try:
+        yield trace
+        record.update(ok=True)
+    except BaseException as e:
+        record.update(ok=False, error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        record['total_s'] = time.perf_counter() - start
+        _current_trace.reset(token)
+
+        if profiler == 'cprofile':
+            profile.disable()
+            record['profile'] = _profile_path(name, '.prof')
+            profile.dump_stats(record['profile'])
+        elif profiler == 'pyinstrument':
+            profile.stop()
+            record['profile'] = _profile_path(name, '.html')
+            with open(record['profile'], 'w') as fh:
+                fh.write(profile.output_html())
+
+        record['stages'] = trace.stages
+        record['counters'] = trace.counters
+        write_record(record)
+
+
+def configure_from_env():
+    """ Like configure, but a bad setting only turns tracing off with a warning """
+    try:
+        configure(
+            trace=os.environ.get(TRACE_ENV) or None,
+            profile=os.environ.get(PROFILE_ENV) or None,
+            profile_to=os.environ.get(PROFILE_DIR_ENV),
+        )
+    except (ValueError, RuntimeError, OSError) as e:
+        warnings.warn(f"Tracing is off: {e}")
+        configure()
+
+
+# This runs when the core library is imported, which mustn't fail because of the environment
+configure_from_env()
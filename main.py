@@ -1,5 +1,9 @@
 from fritzing_parser import load_core_parts, parse_sketch
-from describer import describe_as_html
+from describer import stream_html
+from result_cache import ResultCache, describe_sketch_cached
+import instrumentation
+import serialization
+import argparse
 import sys
 
 from pprint import pprint
@@ -8,11 +12,59 @@ from pprint import pprint
 DEFAULT_INFILE = '/home/troy/tmp/fritzing/inputs/net_labels.fzz'
 
 
-infile = DEFAULT_INFILE
-if len(sys.argv) > 1:
-    infile = sys.argv[1]
+arg_parser = argparse.ArgumentParser(description='Describe a Fritzing sketch as HTML')
+arg_parser.add_argument('infile', nargs='?', default=DEFAULT_INFILE)
+arg_parser.add_argument(
+    '--rebuild-parts-cache',
+    action='store_true',
+    help='Reparse every core part file instead of reusing the on-disk parts cache',
+)
+arg_parser.add_argument(
+    '--workers',
+    type=int,
+    default=1,
+    help='Number of processes to use for parsing core parts that are not cached',
+)
+arg_parser.add_argument(
+    '--eager-parts',
+    action='store_true',
+    help='Parse every core part up front instead of on first use (e.g. to fill the parts cache)',
+)
+arg_parser.add_argument(
+    '--stream-xml',
+    action='store_true',
+    help='Read the sketch one instance at a time instead of loading the whole document',
+)
+arg_parser.add_argument(
+    '--result-cache',
+    metavar='DIR',
+    help='Reuse descriptions of previously seen sketches stored in this directory (HTML only)',
+)
+arg_parser.add_argument(
+    '--format',
+    choices=['html'] + serialization.FORMATS,
+    default='html',
+    help='Output format; json and msgpack are the parsed schematic rather than a description',
+)
+instrumentation.add_arguments(arg_parser)
+args = arg_parser.parse_args()
 
-parts_bin = load_core_parts()
-schematic = parse_sketch(parts_bin, infile)
+instrumentation.configure_from_args(args)
 
-print(describe_as_html(schematic))
+# The trace covers loading the core parts too, since this is the only sketch
+with instrumentation.trace_sketch(args.infile):
+    parts_bin = load_core_parts(
+        rebuild_cache=args.rebuild_parts_cache,
+        workers=args.workers,
+        lazy=not args.eager_parts,
+    )
+
+    if args.format != 'html':
+        schematic = parse_sketch(parts_bin, args.infile, streaming=args.stream_xml)
+        sys.stdout.buffer.write(serialization.dump(schematic, args.format))
+    elif args.result_cache:
+        print(describe_sketch_cached(ResultCache(args.result_cache), parts_bin, args.infile))
+    else:
+        schematic = parse_sketch(parts_bin, args.infile, streaming=args.stream_xml)
+        stream_html(schematic, sys.stdout)
+        print()
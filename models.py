@@ -1,4 +1,5 @@
 from dataclasses import dataclass, field
+from functools import cached_property
 from typing import Dict, List, Optional, Set
 
 
@@ -7,8 +8,11 @@ PartInstanceID = str
 PinID = str
 NodeID = str
 
+# Note: the small classes below use slots since large sketches and the core parts bin
+# create a lot of them, and a __dict__ per instance adds up.
 
-@dataclass
+
+@dataclass(slots=True)
 class PartPin:
     pin_id: PinID  # This may not be globally unique, must be unique per part
     short_name: str  # This will not have the word "pin" in it and should have all space trimmed
@@ -24,14 +28,20 @@ class Part:
     # TODO properties: Dict[str, str] # Relevant key-value properties like resistance, capacitance, package, etc...
     pins: Dict[PinID, PartPin]
 
+    # Only set on GROUND_PART, so templates can check for it without a deep comparison
+    is_ground: bool = False
+
+    # Note: the methods below are called by the template for every connection, so they're
+    # backed by values computed once per part. Parts must not be modified after they're rendered.
+
     def should_show_in_bom(self) -> bool:
-        return self != GROUND_PART
+        return not self.is_ground
 
     def pin_reference(self, pin_id: PinID) -> str:
-        if self == GROUND_PART:
+        if self.is_ground:
             return '' # Don't need a pin name for ground
 
-        kind = 'lead' if len(self.pins) <= 3 else 'pin'
+        kind = self._pin_kind
 
         short_name = self.pins[pin_id].short_name
         if short_name.isnumeric():
@@ -43,6 +53,14 @@ class Part:
         return self.description is not None or self.should_show_pin_descriptions()
 
     def should_show_pin_descriptions(self):
+        return self._show_pin_descriptions
+
+    @cached_property
+    def _pin_kind(self) -> str:
+        return 'lead' if len(self.pins) <= 3 else 'pin'
+
+    @cached_property
+    def _show_pin_descriptions(self) -> bool:
         # Don't show a table for just a couple of pins
         if len(self.pins) < 3:
             return False
@@ -59,7 +77,7 @@ class Part:
         return True
 
 
-@dataclass
+@dataclass(slots=True)
 class PartInstance:
     """ Represents an instance of a part """
     part_instance_id: PartInstanceID
@@ -71,13 +89,13 @@ class PartInstance:
         return self.part_instance_id < other.part_instance_id
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Connection:
     part_instance: PartInstance
     pin_id: PinID
 
 
-@dataclass
+@dataclass(slots=True)
 class Node:
     node_id: NodeID
     label: Optional[str]
@@ -94,7 +112,8 @@ GROUND_PART = Part(
     short_name='Ground',
     description=None,
     designator_prefix='',
-    pins={'common': PartPin('common', 'common', None)}
+    pins={'common': PartPin('common', 'common', None)},
+    is_ground=True,
 )
 
 GROUND_PART_INSTANCE = PartInstance(
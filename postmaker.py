@@ -1,9 +1,40 @@
 # Creates full pages about an FZ project given its URL
 # This allows me to demo and refine the output
-import urllib.request
-from scraper import scrape_single_project
-from fritzing_parser import load_core_parts, parse_sketch
+#
+# Many projects are run through a pipeline of stages connected by bounded queues:
+# scrape -> download -> describe -> write. Scraping and downloading wait on the network so
+# they run on threads; describing is CPU bound so it runs on a process pool that inherits
+# the core parts bin, which is loaded once up front.
+#
+# Usage: python postmaker.py URL... [--out-dir DIR]
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from scraper import (
+    ALLOWED_LICENSES,
+    DEFAULT_HTTP_WORKERS,
+    DriverPool,
+    ProjectListing,
+    scrape_project,
+    scrape_single_project,
+    scrape_with_pool,
+)
+from fritzing_parser import PartsBin, load_core_parts, parse_sketch
 from describer import describe_as_html
+from download_cache import DEFAULT_CACHE_DIR, DownloadCache
+from http_client import HttpClient
+from result_cache import describe_archive_cached
 
 TEMPLATE = '''
 <p>
@@ -21,30 +52,355 @@ and <a href="{proj.license_url}">read the license here</a>.
 {circuit_desc}
 '''
 
-TMP_FILE = '/tmp/scraped.fzz'
+DEFAULT_URL = 'https://fritzing.org/projects/chaos-circuit'
+# Some other good examples:
+# https://fritzing.org/projects/breadboard-wee-blinky
+# https://fritzing.org/projects/pwm-speed-controller
+# https://fritzing.org/projects/metal-detector
+# https://fritzing.org/projects/atari-punk-console-with-cv-inpus
+# https://fritzing.org/projects/fritzing-amplifier
+
+# Loaded before the describe pool starts so the workers inherit it
+core_parts_bin: Optional[PartsBin] = None
 
-def project_to_md(url: str) -> str:
-    proj = scrape_single_project(url)
 
-    first_fzz_url = next((url for name, url in proj.download_urls.items() if name.lower().endswith('.fzz')))
+@functools.lru_cache(maxsize=None)
+def get_core_parts() -> PartsBin:
+    """ Loads the core parts once per process, lazily since a single project only needs a few """
+    return core_parts_bin if core_parts_bin is not None else load_core_parts(lazy=True)
 
-    urllib.request.urlretrieve(first_fzz_url, TMP_FILE)
 
-    # TODO this will redo a lot of work add some memoization or something
-    parts_bin = load_core_parts()
-    schematic = parse_sketch(parts_bin, TMP_FILE)
+def first_fzz_url(proj: ProjectListing) -> str:
+    url = next((url for name, url in proj.download_urls.items() if name.lower().endswith('.fzz')), None)
+    if url is None:
+        raise ValueError(f"No .fzz download for {proj.url}")
+    return url
 
-    circuit_desc = describe_as_html(schematic) 
 
+def render_page(proj: ProjectListing, circuit_desc: str) -> str:
     # TODO use Jinja for this it's not very safe.
     return TEMPLATE.format(proj=proj, circuit_desc=circuit_desc)
 
 
-#url = 'https://fritzing.org/projects/breadboard-wee-blinky'
-url = 'https://fritzing.org/projects/pwm-speed-controller'
-url = 'https://fritzing.org/projects/metal-detector'
-url = 'https://fritzing.org/projects/atari-punk-console-with-cv-inpus'
-url = 'https://fritzing.org/projects/fritzing-amplifier'
-url = 'https://fritzing.org/projects/chaos-circuit'
+def project_to_md(
+    url: str,
+    driver_pool: Optional[DriverPool] = None,
+    download_cache: Optional[DownloadCache] = None,
+) -> str:
+    # Without a pool this starts and stops a browser just for this page
+    proj = scrape_single_project(url) if driver_pool is None else scrape_with_pool(url, driver_pool)
+
+    download_cache = download_cache or DownloadCache()
+    with HttpClient() as client:
+        download = download_cache.fetch(client, first_fzz_url(proj))
+
+    schematic = parse_sketch(get_core_parts(), download.path)
+
+    circuit_desc = describe_as_html(schematic)
+
+    return render_page(proj, circuit_desc)
+
+
+@dataclass
+class Job:
+    """ One project on its way through the pipeline; each stage fills in the next field """
+    url: str
+    listing: Optional[ProjectListing] = None
+    archive: Optional[bytes] = None
+    page: Optional[str] = None
+
+
+class SkipJob(Exception):
+    """ Raised by a stage to drop a job without counting it as a failure """
+
+
+# Passed down the queues after the last job
+END = object()
+
+
+class Stage:
+    """
+    A pool of threads that take jobs from in_queue, run fn on them, and put them on
+    out_queue. Jobs that fn fails on are recorded and dropped.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[Job], None],
+        workers: int,
+        in_queue: queue.Queue,
+        out_queue: Optional[queue.Queue],
+    ):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+
+        self._lock = threading.Lock()
+        self._running = workers
+        self.done = 0
+        self.skipped = 0
+        self.failures: List[Dict[str, str]] = []
+        self.busy_s = 0.0
+        self.first_start: Optional[float] = None
+        self.last_finish: Optional[float] = None
+
+        self._threads = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True) for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            job = self.in_queue.get()
+            if job is END:
+                self.in_queue.put(END)  # For this stage's other threads
+                with self._lock:
+                    self._running -= 1
+                    last = self._running == 0
+                if last and self.out_queue is not None:
+                    self.out_queue.put(END)
+                return
+
+            start = time.perf_counter()
+            try:
+                self.fn(job)
+                ok, skipped = True, False
+            except SkipJob:
+                ok, skipped = False, True
+            except Exception as e:
+                ok, skipped = False, False
+                error = f"{type(e).__name__}: {e}"
+                print(f"{self.name} failed for {job.url}: {error}", file=sys.stderr)
+            finish = time.perf_counter()
+
+            with self._lock:
+                self.busy_s += finish - start
+                self.first_start = start if self.first_start is None else min(self.first_start, start)
+                self.last_finish = finish
+                if ok:
+                    self.done += 1
+                elif skipped:
+                    self.skipped += 1
+                else:
+                    self.failures.append({'url': job.url, 'error': error})
+
+            if ok and self.out_queue is not None:
+                self.out_queue.put(job)  # Blocks while the next stage is behind
+
+    def stats(self) -> Dict[str, Any]:
+        active_s = (self.last_finish - self.first_start) if self.done else 0.0
+        return {
+            'workers': self.workers,
+            'done': self.done,
+            'skipped': self.skipped,
+            'failed': len(self.failures),
+            'busy_s': self.busy_s,
+            'per_s': self.done / active_s if active_s > 0 else None,
+            'utilization': self.busy_s / (active_s * self.workers) if active_s > 0 else None,
+        }
+
+
+class QueueMonitor:
+    """ Samples the depth of the queues in the background """
+
+    def __init__(self, queues: Dict[str, queue.Queue], interval_s: float = 0.05):
+        self.queues = queues
+        self.interval_s = interval_s
+        self.samples: Dict[str, List[int]] = {name: [] for name in queues}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            for name, q in self.queues.items():
+                self.samples[name].append(q.qsize())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                'max_size': self.queues[name].maxsize,
+                'mean_depth': sum(s) / len(s) if s else 0.0,
+                'max_depth': max(s, default=0),
+            }
+            for name, s in self.samples.items()
+        }
+
+
+def describe_archive(archive: bytes) -> str:
+    """ Runs in a describe worker """
+    return describe_archive_cached(None, core_parts_bin, archive)
+
+
+def page_file_name(url: str) -> str:
+    return (urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1] or 'index') + '.md'
+
+
+def run_pipeline(
+    urls: List[str],
+    out_dir: Optional[str],
+    scrape_workers: int = 8,
+    download_workers: int = 8,
+    describe_workers: int = os.cpu_count(),
+    queue_size: int = 32,
+    driver_pool: Optional[DriverPool] = None,
+    download_cache: Optional[DownloadCache] = None,
+) -> Dict[str, Any]:
+    """
+    Writes a page for each project to out_dir (or stdout) and returns stats for each stage
+    and queue. Projects whose license isn't allowed are skipped before anything is downloaded,
+    and archives already in download_cache are only downloaded again if they've changed.
+    """
+    global core_parts_bin
+    # Parsed in full, so the describe workers inherit every part instead of each parsing
+    # the ones it needs again
+    core_parts_bin = load_core_parts(workers=describe_workers)
+    download_cache = download_cache or DownloadCache()
+
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+
+    # Bounded, so a stage that's ahead waits for the next one instead of piling up jobs
+    # (and downloaded archives) in memory
+    queues = {
+        'scrape': queue.Queue(maxsize=queue_size),
+        'download': queue.Queue(maxsize=queue_size),
+        'describe': queue.Queue(maxsize=queue_size),
+        'write': queue.Queue(maxsize=queue_size),
+    }
+
+    client = HttpClient(max_idle_per_host=max(scrape_workers, download_workers))
+    describe_pool = ProcessPoolExecutor(max_workers=describe_workers, mp_context=multiprocessing.get_context('fork'))
+    write_lock = threading.Lock()
+
+    def scrape(job: Job):
+        job.listing = scrape_project(job.url, client, driver_pool)
+        if job.listing.license_url not in ALLOWED_LICENSES:
+            print(f"Skipping {job.url}: license {job.listing.license_url} isn't allowed", file=sys.stderr)
+            raise SkipJob()
+
+    def download(job: Job):
+        download = download_cache.fetch(client, first_fzz_url(job.listing))
+        with open(download.path, 'rb') as fh:
+            job.archive = fh.read()
+
+    def describe(job: Job):
+        # Each of these threads keeps one worker process busy
+        circuit_desc = describe_pool.submit(describe_archive, job.archive).result()
+        job.archive = None  # Don't hold on to it any longer than we need to
+        job.page = render_page(job.listing, circuit_desc)
+
+    def write(job: Job):
+        if out_dir is None:
+            with write_lock:
+                sys.stdout.write(job.page)
+                sys.stdout.flush()
+            return
+
+        path = os.path.join(out_dir, page_file_name(job.url))
+        with open(path + '.tmp', 'w') as fh:
+            fh.write(job.page)
+        os.replace(path + '.tmp', path)
+
+    stages = [
+        Stage('scrape', scrape, scrape_workers, queues['scrape'], queues['download']),
+        Stage('download', download, download_workers, queues['download'], queues['describe']),
+        Stage('describe', describe, describe_workers, queues['describe'], queues['write']),
+        Stage('write', write, 1, queues['write'], None),
+    ]
+
+    # Start the describe workers before any threads exist, since forking with threads running is asking for trouble
+    for future in [describe_pool.submit(len, b'') for _ in range(describe_workers)]:
+        future.result()
+
+    monitor = QueueMonitor(queues)
+    start = time.perf_counter()
+    try:
+        for stage in stages:
+            stage.start()
+        monitor.start()
+
+        for url in urls:
+            queues['scrape'].put(Job(url=url))
+        queues['scrape'].put(END)
+
+        for stage in stages:
+            stage.join()
+    finally:
+        monitor.stop()
+        describe_pool.shutdown(cancel_futures=True)
+        client.close()
+
+    elapsed = time.perf_counter() - start
+    return {
+        'projects': len(urls),
+        'written': stages[-1].done,
+        'seconds': elapsed,
+        'per_s': stages[-1].done / elapsed,
+        'stages': {stage.name: stage.stats() for stage in stages},
+        'queues': monitor.stats(),
+        'download_cache': download_cache.stats(),
+        'failures': [dict(f, stage=stage.name) for stage in stages for f in stage.failures],
+    }
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Make pages about Fritzing projects')
+    arg_parser.add_argument('urls', nargs='*', default=[DEFAULT_URL])
+    arg_parser.add_argument('--urls-file', help='Also read project URLs from this file, one per line')
+    arg_parser.add_argument('--out-dir', help='Write one .md file per project here instead of to stdout')
+    arg_parser.add_argument('--scrape-workers', type=int, default=DEFAULT_HTTP_WORKERS)
+    arg_parser.add_argument('--download-workers', type=int, default=8)
+    arg_parser.add_argument('--describe-workers', type=int, default=os.cpu_count())
+    arg_parser.add_argument('--queue-size', type=int, default=32, help='Jobs allowed to wait between two stages')
+    arg_parser.add_argument('--drivers', type=int, default=2, help='Browsers for pages that need JS to scrape')
+    arg_parser.add_argument(
+        '--download-cache',
+        metavar='DIR',
+        default=DEFAULT_CACHE_DIR,
+        help='Keep downloaded archives here and only download them again if they change',
+    )
+    arg_parser.add_argument('--download-cache-mb', type=int, default=1024, help='Size cap for the download cache')
+    arg_parser.add_argument('--report', help='Write the pipeline stats here as JSON (default: stderr)')
+    args = arg_parser.parse_args()
+
+    urls = list(args.urls)
+    if args.urls_file:
+        with open(args.urls_file, 'r') as fh:
+            urls += [line.strip() for line in fh if line.strip() and not line.startswith('#')]
+
+    with DriverPool(args.drivers) as driver_pool:
+        report = run_pipeline(
+            urls,
+            args.out_dir,
+            scrape_workers=args.scrape_workers,
+            download_workers=args.download_workers,
+            describe_workers=args.describe_workers,
+            queue_size=args.queue_size,
+            driver_pool=driver_pool,
+            download_cache=DownloadCache(args.download_cache, max_bytes=args.download_cache_mb * 1024 * 1024),
+        )
+
+    if args.report:
+        with open(args.report, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        print(json.dumps(report, indent=2), file=sys.stderr)
 
-print(project_to_md(url))
+    sys.exit(1 if report['failures'] else 0)
@@ -0,0 +1,120 @@
+# An on-disk cache of finished descriptions, keyed by the content of the sketch archive.
+# We see the same .fzz files over and over (re-scrapes, mirrors, re-uploads), and a hit
+# skips unzipping, XML parsing and rendering entirely.
+#
+# Usage: python result_cache.py stats CACHE_DIR
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+from typing import Dict, Optional, Union
+
+from fritzing_parser import PartsBin, parse_sketch
+from describer import describe_as_html, template_version
+from disk_cache import DiskCache
+import instrumentation
+
+RESULT_EXTENSION = '.html'
+
+
+class ResultCache(DiskCache):
+    """
+    Stores one HTML file per result, named by its key: a hash of the archive, the parts bin's
+    fingerprint and the template version, so a change to any of them is a miss.
+    """
+
+    EXTENSION = RESULT_EXTENSION
+
+    @staticmethod
+    def key(archive: bytes, parts_bin: PartsBin) -> Optional[str]:
+        """ Returns None if the result can't be cached because the parts bin is unidentified """
+        if parts_bin.fingerprint is None:
+            return None
+
+        h = hashlib.sha256(archive)
+        h.update(parts_bin.fingerprint.encode())
+        h.update(template_version().encode())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + RESULT_EXTENSION)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as fh:
+                html = fh.read()
+            os.utime(path)  # Mark it as recently used
+        except FileNotFoundError:  # Can also happen if it was evicted between the open and utime
+            return None
+
+        return html
+
+    def put(self, key: str, html: str):
+        self._write_atomic(self._path(key), html.encode('utf-8'))
+        self.evict()
+
+    def record(self, hit: bool, archive_bytes: int):
+        """ Adds a lookup to the stats file, which is shared by every user of the cache """
+        def update(stats: dict):
+            stats['hits'] = stats.get('hits', 0) + hit
+            stats['misses'] = stats.get('misses', 0) + (not hit)
+            if hit:
+                # Archive bytes we didn't have to unzip and parse
+                stats['bytes_saved'] = stats.get('bytes_saved', 0) + archive_bytes
+
+        self._update_stats(update)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        stats = self._read_stats()
+
+        hits = stats.get('hits', 0)
+        misses = stats.get('misses', 0)
+        sizes = self._entry_sizes()
+
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'bytes_saved': stats.get('bytes_saved', 0),
+            'entries': len(sizes),
+            'size_bytes': sum(sizes),
+        }
+
+
+def describe_sketch_cached(cache: Optional[ResultCache], parts_bin: PartsBin, path: str) -> str:
+    """ Same as describe_as_html(parse_sketch(parts_bin, path)), but goes through the cache if there is one """
+    with open(path, 'rb') as fh:
+        return describe_archive_cached(cache, parts_bin, fh.read())
+
+
+def describe_archive_cached(cache: Optional[ResultCache], parts_bin: PartsBin, archive: bytes) -> str:
+    """ Like describe_sketch_cached, but takes the contents of the .fzz archive """
+    key = None if cache is None else cache.key(archive, parts_bin)
+    if key is not None:
+        html = cache.get(key)
+        cache.record(html is not None, len(archive))
+        instrumentation.count('result_cache_hits' if html is not None else 'result_cache_misses')
+        if html is not None:
+            return html
+
+    html = describe_as_html(parse_sketch(parts_bin, io.BytesIO(archive)))
+
+    if key is not None:
+        cache.put(key, html)
+
+    return html
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Inspect a sketch result cache')
+    arg_parser.add_argument('command', choices=['stats'])
+    arg_parser.add_argument('cache_dir')
+    args = arg_parser.parse_args()
+
+    if not os.path.isdir(args.cache_dir):
+        sys.exit(f"No cache at {args.cache_dir}")
+
+    print(json.dumps(ResultCache(args.cache_dir).stats(), indent=2))
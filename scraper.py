@@ -1,8 +1,24 @@
-from dataclasses import dataclass
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple, Union
+from urllib.parse import urljoin, urlsplit
+import argparse
+import html
+import json
+import queue
+import sys
+import threading
+import time
 
+from lxml import etree
+import lxml.html
 from selenium import webdriver
+from selenium.common.exceptions import NoSuchElementException, WebDriverException
 from selenium.webdriver.common.by import By
+from selenium.webdriver.firefox.options import Options as FirefoxOptions
+
+from http_client import HttpClient
 
 @dataclass
 class ProjectListing:
@@ -23,13 +39,130 @@ ALLOWED_LICENSES = {
 
 FIRST_PAGE = 1
 LAST_PAGE = 5 # TODO
+# Pages of the project list, see crawler.py
+PROJECT_LIST_URL = 'https://fritzing.org/projects/?page={page}'
 
+# Browsers are restarted after this many pages, since they get slower and leak memory over time
+DEFAULT_PAGES_PER_DRIVER = 50
+PAGE_LOAD_TIMEOUT_S = 60
+# Pages fetched at once by the HTTP backend, which is mostly waiting on the network
+DEFAULT_HTTP_WORKERS = 16
 
-def scrape_single_project(url: str, driver:Optional[webdriver.Firefox]=None) -> ProjectListing:
-    ephemeral_driver = driver is None
 
-    if ephemeral_driver:
-        driver = webdriver.Firefox()
+def new_driver(headless: bool = True) -> webdriver.Firefox:
+    options = FirefoxOptions()
+    if headless:
+        options.add_argument('-headless')
+
+    driver = webdriver.Firefox(options=options)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT_S)
+    return driver
+
+
+class DriverPool:
+    """
+    A bounded set of long lived browsers, so each page doesn't pay for starting one.
+    Browsers are started as they're first needed, and replaced when they've loaded max_pages
+    pages or something went wrong while using them. Safe to use from multiple threads.
+    """
+
+    size: int
+    headless: bool
+    max_pages: int
+
+    def __init__(self, size: int, headless: bool = True, max_pages: int = DEFAULT_PAGES_PER_DRIVER):
+        self.size = size
+        self.headless = headless
+        self.max_pages = max_pages
+
+        # Idle drivers and how many pages each has loaded. None is a slot without a browser yet.
+        self._idle: queue.Queue[Optional[Tuple[webdriver.Firefox, int]]] = queue.Queue()
+        for _ in range(size):
+            self._idle.put(None)
+
+        self._lock = threading.Lock()
+        self._closed = False
+        self.started = 0
+        self.recycled = 0
+
+    @contextmanager
+    def driver(self, timeout: Optional[float] = None) -> Iterator[webdriver.Firefox]:
+        """ Checks out a driver for loading one page, blocking until one is free """
+        driver, pages = self.checkout(timeout)
+        healthy = True
+        try:
+            yield driver
+        except NoSuchElementException:  # The page wasn't what we expected, but the browser is fine
+            raise
+        except BaseException:  # e.g. the browser crashed or hung, so don't reuse it
+            healthy = False
+            raise
+        finally:
+            self.checkin(driver, pages + 1, healthy)
+
+    def checkout(self, timeout: Optional[float] = None) -> Tuple[webdriver.Firefox, int]:
+        """ Returns a driver and the number of pages it's loaded; it must be given back with checkin """
+        if self._closed:
+            raise RuntimeError("DriverPool is closed")
+
+        entry = self._idle.get(timeout=timeout)
+        if entry is not None:
+            return entry
+
+        try:
+            driver = new_driver(self.headless)
+        except Exception:
+            self._idle.put(None)  # Give the slot back so a later checkout can try again
+            raise
+
+        with self._lock:
+            self.started += 1
+        return driver, 0
+
+    def checkin(self, driver: webdriver.Firefox, pages: int, healthy: bool = True):
+        """ Returns a checked out driver. Unhealthy or worn out drivers are shut down. """
+        if healthy and pages < self.max_pages and not self._closed:
+            self._idle.put((driver, pages))
+            return
+
+        quit_driver(driver)
+        with self._lock:
+            self.recycled += 1
+        self._idle.put(None)
+
+    def close(self):
+        """ Shuts down the idle drivers; drivers that are checked out are shut down when returned """
+        self._closed = True
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                quit_driver(entry[0])
+
+    def __enter__(self) -> 'DriverPool':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def quit_driver(driver: webdriver.Firefox):
+    try:
+        driver.quit()
+    except WebDriverException:  # Probably already dead
+        pass
+
+
+def scrape_single_project(url: str, driver:Optional[webdriver.Firefox]=None) -> ProjectListing:
+    if driver is None:
+        # Quit even if scraping fails, so the browser doesn't outlive the page
+        driver = new_driver()
+        try:
+            return scrape_single_project(url, driver)
+        finally:
+            quit_driver(driver)
 
     driver.get(url)
 
@@ -50,12 +183,179 @@ def scrape_single_project(url: str, driver:Optional[webdriver.Firefox]=None) ->
         download_urls=download_urls,
     )
 
-    if ephemeral_driver:
-        driver.close()
-
     return res
 
 
-#with webdriver.Firefox() as driver:
-#    print(scrape_single_project(driver, 'https://fritzing.org/projects/arduino-bipolar-stepper-motor-controller'))
-    #print(scrape_single_project(driver, 'https://fritzing.org/projects/serial-voice'))
+def scrape_with_pool(url: str, pool: DriverPool) -> ProjectListing:
+    with pool.driver() as driver:
+        return scrape_single_project(url, driver)
+
+
+class MissingElementError(Exception):
+    """ The page's static markup doesn't have something we need, e.g. because it's added by JS """
+
+
+def has_class(name: str) -> str:
+    """ An XPath predicate equivalent to the CSS selector .name """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# The CSS selectors scrape_single_project uses, as XPath since lxml's CSS selector support
+# needs the cssselect package
+GALLERY_LINKS_XPATH = etree.XPath(f"//*[{has_class('thumb-gallery')}]/li/a")  # .thumb-gallery > li > a
+DOWNLOAD_LINKS_XPATH = etree.XPath(f"//*[{has_class('highlight')}]//li/a")  # .highlight li > a
+TAGLINE_XPATH = etree.XPath(f"//*[{has_class('lead')}]")  # .lead
+# #content div.row:nth-child(4) > div:nth-child(1)
+DESCRIPTION_XPATH = etree.XPath(
+    f"//*[@id='content']//div[{has_class('row')}][count(preceding-sibling::*) = 3]/*[1][self::div]"
+)
+# .meta > h3:nth-child(1) > a:nth-child(1)
+CREATOR_XPATH = etree.XPath(f"//*[{has_class('meta')}]/*[1][self::h3]/*[1][self::a]")
+LICENSE_LINK_XPATH = etree.XPath(f"//*[{has_class('license')}]/a")  # .license > a
+
+
+def inner_text(elem: etree._Element) -> str:
+    # Close enough to the browser's innerText for the simple markup we look at
+    return ' '.join(elem.text_content().split())
+
+
+def inner_html(elem: etree._Element) -> str:
+    return html.escape(elem.text or '', quote=False) + ''.join(
+        lxml.html.tostring(child, encoding='unicode') for child in elem
+    )
+
+
+def parse_project_page(url: str, page: Union[str, bytes], base_url: Optional[str] = None) -> ProjectListing:
+    """
+    Extracts the same listing as scrape_single_project from a project page's HTML. Links are
+    resolved against base_url (default url), i.e. where the page was actually fetched from.
+    Raises MissingElementError if the page doesn't have everything in its static markup.
+    """
+    doc = lxml.html.fromstring(page)
+    base_url = base_url or url
+
+    def first(xpath: etree.XPath, what: str) -> etree._Element:
+        found = xpath(doc)
+        if not found:
+            raise MissingElementError(f"No {what} found in {url}")
+        return found[0]
+
+    def href(a: etree._Element) -> str:
+        return urljoin(base_url, a.get('href', ''))
+
+    title = doc.find('.//title')
+
+    return ProjectListing(
+        url=url,
+        title='' if title is None else inner_text(title),
+        tagline=inner_text(first(TAGLINE_XPATH, 'tagline')),
+        description_html=inner_html(first(DESCRIPTION_XPATH, 'description')),
+        creator=inner_text(first(CREATOR_XPATH, 'creator')),
+        license_url=href(first(LICENSE_LINK_XPATH, 'license link')),
+        image_urls=[href(a) for a in GALLERY_LINKS_XPATH(doc)],
+        download_urls={inner_text(a): href(a) for a in DOWNLOAD_LINKS_XPATH(doc)},
+    )
+
+
+def parse_project_list_page(url: str, page: Union[str, bytes]) -> List[str]:
+    """ Returns the URLs of the projects linked from a page of the project list, in order """
+    doc = lxml.html.fromstring(page)
+
+    urls = []
+    for a in doc.iter('a'):
+        project_url = urljoin(url, a.get('href', '')).split('#')[0]
+        # Project pages are /projects/<slug>; the list itself is /projects/?page=N
+        path = urlsplit(project_url).path.rstrip('/')
+        if path.startswith('/projects/') and path.count('/') == 2 and project_url not in urls:
+            urls.append(project_url)
+
+    return urls
+
+
+def scrape_single_project_http(url: str, client: HttpClient) -> ProjectListing:
+    """ Like scrape_single_project but without a browser, which is much faster but doesn't run JS """
+    response = client.get(url)
+    if response.status != 200:
+        raise RuntimeError(f"HTTP {response.status} fetching {url}")
+
+    return parse_project_page(url, response.body, base_url=response.url)
+
+
+def scrape_project(url: str, client: HttpClient, pool: Optional[DriverPool] = None) -> ProjectListing:
+    """ Scrapes over plain HTTP, falling back to a browser from pool for pages that need JS """
+    try:
+        return scrape_single_project_http(url, client)
+    except MissingElementError:
+        if pool is None:
+            raise
+        return scrape_with_pool(url, pool)
+
+
+def scrape_projects(
+    urls: Iterable[str],
+    pool: Optional[DriverPool] = None,
+    client: Optional[HttpClient] = None,
+    workers: Optional[int] = None,
+) -> Iterator[Tuple[str, Union[ProjectListing, Exception]]]:
+    """
+    Scrapes the projects concurrently, with client if given (falling back to pool), or else
+    with pool alone, one page per driver at a time. Yields (url, listing) in the order the
+    URLs were given, with the exception in place of the listing for pages that failed.
+    """
+    scrape: Callable[[str], ProjectListing]
+    if client is not None:
+        scrape = lambda url: scrape_project(url, client, pool)
+        workers = workers or DEFAULT_HTTP_WORKERS
+    elif pool is not None:
+        scrape = lambda url: scrape_with_pool(url, pool)
+        workers = workers or pool.size
+    else:
+        raise ValueError("Need an HTTP client or a driver pool to scrape with")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(url, executor.submit(scrape, url)) for url in urls]
+        for url, future in futures:
+            try:
+                yield url, future.result()
+            except Exception as e:
+                yield url, e
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Scrape Fritzing project pages, printing one JSON listing per line')
+    arg_parser.add_argument('urls', nargs='+')
+    arg_parser.add_argument(
+        '--backend',
+        choices=['http', 'browser'],
+        default='http',
+        help='Fetch pages over plain HTTP (falling back to a browser if a page needs JS) or always use a browser',
+    )
+    arg_parser.add_argument('--workers', type=int, default=DEFAULT_HTTP_WORKERS, help='Pages to fetch at once over HTTP')
+    arg_parser.add_argument('--drivers', type=int, default=4, help='Number of browsers to run at once')
+    arg_parser.add_argument('--pages-per-driver', type=int, default=DEFAULT_PAGES_PER_DRIVER)
+    arg_parser.add_argument('--show-browser', action='store_true', help="Don't run the browsers headless")
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    failed = 0
+    # Browsers are only started if they're needed
+    with DriverPool(args.drivers, headless=not args.show_browser, max_pages=args.pages_per_driver) as pool, \
+            HttpClient(max_idle_per_host=args.workers) as client:
+        if args.backend == 'http':
+            results = scrape_projects(args.urls, pool, client, args.workers)
+        else:
+            results = scrape_projects(args.urls, pool)
+
+        for url, result in results:
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"FAILED {url}: {type(result).__name__}: {result}", file=sys.stderr)
+            else:
+                print(json.dumps(asdict(result)))
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(args.urls) - failed} scraped, {failed} failed in {elapsed:.1f}s "
+        f"({len(args.urls) / elapsed:.2f} pages/s, {pool.started} browsers started)",
+        file=sys.stderr,
+    )
@@ -0,0 +1,183 @@
+# Machine readable versions of a described schematic, for consumers like the search indexer
+# that would otherwise have to parse the HTML back apart. The loaders turn them back into a
+# Schematic, so a stored description can be rendered to HTML later without the .fzz file.
+#
+# Usage: python serialization.py render FILE  (prints the HTML for a .json or .msgpack file)
+import argparse
+import json
+from typing import Any, Dict, Union
+
+try:
+    import msgpack
+except ImportError:  # Optional; only needed for the msgpack format
+    msgpack = None
+
+from models import *
+from describer import collect_parts, describe_as_html
+from fritzing_parser import FzPart
+
+# Bump this when the structure below changes incompatibly
+FORMAT_VERSION = 1
+
+FORMATS = ['json', 'msgpack']
+
+
+def part_to_dict(part: Part) -> Dict[str, Any]:
+    d = {
+        'part_id': part.part_id,
+        'short_name': part.short_name,
+        'description': part.description,
+        'designator_prefix': part.designator_prefix,
+        'is_ground': part.is_ground,
+        'pins': [
+            {'pin_id': p.pin_id, 'short_name': p.short_name, 'description': p.description}
+            for p in part.pins.values()
+        ],
+    }
+
+    if isinstance(part, FzPart):
+        d['properties'] = part.properties
+        d['display_properties'] = part.display_properties
+
+    return d
+
+
+def part_from_dict(d: Dict[str, Any]) -> Part:
+    if d['is_ground']:
+        return GROUND_PART
+
+    fields = dict(
+        part_id=d['part_id'],
+        short_name=d['short_name'],
+        description=d['description'],
+        designator_prefix=d['designator_prefix'],
+        pins={
+            p['pin_id']: PartPin(pin_id=p['pin_id'], short_name=p['short_name'], description=p['description'])
+            for p in d['pins']
+        },
+    )
+
+    if 'properties' in d:
+        return FzPart(**fields, properties=d['properties'], display_properties=d['display_properties'])
+    return Part(**fields)
+
+
+def schematic_to_dict(schematic: Schematic) -> Dict[str, Any]:
+    """ Converts a schematic to plain dicts and lists. Parts shared between instances are stored once. """
+    parts: Dict[PartID, Dict[str, Any]] = {}
+    for pinst in schematic.part_instances_by_id.values():
+        if pinst.part.part_id not in parts:
+            parts[pinst.part.part_id] = part_to_dict(pinst.part)
+
+    return {
+        'format_version': FORMAT_VERSION,
+        'parts': list(parts.values()),
+        'part_instances': [
+            {'part_instance_id': pinst.part_instance_id, 'designator': pinst.designator, 'part_id': pinst.part.part_id}
+            for pinst in schematic.part_instances_by_id.values()
+        ],
+        'nodes': [
+            {
+                'node_id': node.node_id,
+                'label': node.label,
+                'connections': [[c.part_instance.part_instance_id, c.pin_id] for c in node.connections],
+            }
+            for node in schematic.nodes_by_id.values()
+        ],
+        # Same as the bill of materials in the HTML; the loader doesn't need it
+        'bom': [
+            {
+                'part_id': info.part.part_id,
+                'short_name': info.part.short_name,
+                'designators': [i.designator for i in info.instances],
+            }
+            for info in collect_parts(schematic)
+            if info.part.should_show_in_bom()
+        ],
+    }
+
+
+def schematic_from_dict(d: Dict[str, Any]) -> Schematic:
+    if d.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported serialized schematic version {d.get('format_version')}")
+
+    parts = {p['part_id']: part_from_dict(p) for p in d['parts']}
+
+    schematic = Schematic()
+    for pi in d['part_instances']:
+        if parts[pi['part_id']] is GROUND_PART:
+            pinst = GROUND_PART_INSTANCE
+        else:
+            pinst = PartInstance(
+                part_instance_id=pi['part_instance_id'],
+                designator=pi['designator'],
+                part=parts[pi['part_id']],
+            )
+        schematic.part_instances_by_id[pinst.part_instance_id] = pinst
+
+    for n in d['nodes']:
+        schematic.nodes_by_id[n['node_id']] = Node(
+            node_id=n['node_id'],
+            label=n['label'],
+            connections=[
+                Connection(part_instance=schematic.part_instances_by_id[instance_id], pin_id=pin_id)
+                for instance_id, pin_id in n['connections']
+            ],
+        )
+
+    return schematic
+
+
+def dump_json(schematic: Schematic) -> str:
+    return json.dumps(schematic_to_dict(schematic), separators=(',', ':'))
+
+
+def load_json(data: Union[str, bytes]) -> Schematic:
+    return schematic_from_dict(json.loads(data))
+
+
+def require_msgpack():
+    if msgpack is None:
+        raise RuntimeError("The msgpack format needs the msgpack package (pip install msgpack)")
+
+
+def dump_msgpack(schematic: Schematic) -> bytes:
+    require_msgpack()
+    return msgpack.packb(schematic_to_dict(schematic))
+
+
+def load_msgpack(data: bytes) -> Schematic:
+    require_msgpack()
+    return schematic_from_dict(msgpack.unpackb(data))
+
+
+def dump(schematic: Schematic, fmt: str) -> bytes:
+    """ Serializes to one of FORMATS, as bytes either way """
+    if fmt == 'json':
+        return dump_json(schematic).encode('utf-8')
+    elif fmt == 'msgpack':
+        return dump_msgpack(schematic)
+    else:
+        raise ValueError(f"Unknown format {fmt}")
+
+
+def load(data: bytes, fmt: str) -> Schematic:
+    if fmt == 'json':
+        return load_json(data)
+    elif fmt == 'msgpack':
+        return load_msgpack(data)
+    else:
+        raise ValueError(f"Unknown format {fmt}")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Work with serialized schematics')
+    arg_parser.add_argument('command', choices=['render'])
+    arg_parser.add_argument('file', help='A .json or .msgpack file')
+    args = arg_parser.parse_args()
+
+    with open(args.file, 'rb') as fh:
+        data = fh.read()
+
+    fmt = 'msgpack' if args.file.endswith('.msgpack') else 'json'
+    print(describe_as_html(load(data, fmt)))
@@ -0,0 +1,317 @@
+# A long running describe service for the web front end. The core parts bin is loaded once
+# and shared by fork with a pool of worker processes, so each request only pays for its sketch.
+#
+# Endpoints:
+#   POST /describe            body is the .fzz archive; responds with the HTML description
+#   GET  /describe?path=P     describes the .fzz at path P on this machine
+#   GET  /health              liveness (including of the worker pool) and basic info as JSON
+#   GET  /metrics             request counts and latency percentiles as JSON
+import argparse
+import json
+import multiprocessing
+import os
+import socketserver
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Optional, Union
+from urllib.parse import parse_qs, urlparse
+
+from fritzing_parser import GENERATED_PART_CACHE, PartsBin, load_core_parts
+from result_cache import ResultCache, describe_archive_cached, describe_sketch_cached
+import instrumentation
+
+# Uploads bigger than this are rejected
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024
+# Latency percentiles are computed over this many of the most recent requests
+LATENCY_WINDOW = 1000
+
+# Loaded before the pool starts so the workers inherit them
+core_parts_bin: Optional[PartsBin] = None
+result_cache: Optional[ResultCache] = None
+
+
+def describe_archive(sketch: Union[str, bytes]) -> str:
+    """ Runs in a worker. Takes the path or the contents of a .fzz archive. """
+    if isinstance(sketch, bytes):
+        with instrumentation.trace_sketch('upload'):
+            return describe_archive_cached(result_cache, core_parts_bin, sketch)
+
+    with instrumentation.trace_sketch(sketch):
+        return describe_sketch_cached(result_cache, core_parts_bin, sketch)
+
+
+def worker_stats() -> Dict[str, int]:
+    return GENERATED_PART_CACHE.stats()
+
+
+class WorkerPool:
+    """
+    A process pool that replaces itself when a worker dies. ProcessPoolExecutor gives up for
+    good once a worker is killed (e.g. by the OOM killer), failing every later task.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._executor = self._start()
+
+    def _start(self) -> ProcessPoolExecutor:
+        # Start all the workers now. The first time this is before any request threads exist;
+        # a replacement pool is forked with them running, which is OK since the workers only
+        # use locks of their own.
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+        for future in [executor.submit(worker_stats) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def restart(self, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        """ Replaces the pool if it's still `broken` (another thread may have already) """
+        with self._lock:
+            if self._executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._start()
+                self.restarts += 1
+            return self._executor
+
+    def run(self, fn: Callable, *args) -> Any:
+        """ Runs fn in a worker. Raises BrokenProcessPool if the worker died, after replacing the pool. """
+        executor = self._executor
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:  # Broken by an earlier task; this one hasn't run yet
+            executor = self.restart(executor)
+            future = executor.submit(fn, *args)
+
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self.restart(executor)
+            raise
+
+    def check(self) -> bool:
+        """ Returns whether the pool is usable, replacing it first if a worker has died """
+        executor = self._executor
+        try:
+            executor.submit(int)  # Fails straight away if the pool is broken
+        except BrokenProcessPool:
+            try:
+                self.restart(executor)
+            except Exception:
+                return False
+        return True
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+class Metrics:
+    """ Thread safe request counters and a window of recent latencies """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.started_at = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.in_flight = 0
+
+    def start_request(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def finish_request(self, seconds: float, ok: bool):
+        with self._lock:
+            self.in_flight -= 1
+            self._latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+
+    def reject_request(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            result = {
+                'uptime_s': time.time() - self.started_at,
+                'requests': self.requests,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'in_flight': self.in_flight,
+            }
+
+        if latencies:
+            def percentile(p: float) -> float:
+                return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+            result['latency_s'] = {
+                'mean': statistics.fmean(latencies),
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': latencies[-1],
+            }
+
+        return result
+
+
+class DescribeHandler(BaseHTTPRequestHandler):
+    # Set by serve()
+    pool: WorkerPool
+    slots: threading.BoundedSemaphore  # Limits the number of sketches queued or in progress
+    metrics: Metrics
+    part_count: int
+    worker_count: int
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path == '/health':
+            ok = self.pool.check()
+            self.send_json(200 if ok else 503, {
+                'status': 'ok' if ok else 'workers unavailable',
+                'core_parts': self.part_count,
+                'pid': os.getpid(),
+            })
+        elif url.path == '/metrics':
+            metrics = self.metrics.snapshot()
+            metrics['workers'] = self.worker_count
+            metrics['worker_pool_restarts'] = self.pool.restarts
+            self.send_json(200, metrics)
+        elif url.path == '/describe':
+            paths = parse_qs(url.query).get('path')
+            if not paths:
+                self.send_text(400, 'Missing path parameter')
+                return
+            self.describe(paths[0])
+        else:
+            self.send_text(404, 'Not found')
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/describe':
+            self.send_text(404, 'Not found')
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_UPLOAD_BYTES:
+            self.send_text(413 if length > 0 else 400, 'Expected a .fzz archive in the request body')
+            return
+
+        self.describe(self.rfile.read(length))
+
+    def describe(self, sketch: Union[str, bytes]):
+        if not self.slots.acquire(blocking=False):
+            self.metrics.reject_request()
+            self.send_text(503, 'Too many requests in progress')
+            return
+
+        self.metrics.start_request()
+        start = time.perf_counter()
+        ok = False
+        try:
+            html = self.pool.run(describe_archive, sketch)
+            ok = True
+        except BrokenProcessPool:
+            # Our problem rather than the sketch's (though a sketch that crashes a worker
+            # will do it again)
+            self.send_text(503, 'A worker died while describing the sketch; try again')
+        except Exception as e:
+            self.send_text(422, f"Could not describe sketch: {type(e).__name__}: {e}")
+        finally:
+            self.slots.release()
+            self.metrics.finish_request(time.perf_counter() - start, ok)
+
+        if ok:
+            self.send_body(200, 'text/html; charset=utf-8', html.encode('utf-8'))
+
+    def send_json(self, status: int, value: dict):
+        self.send_body(status, 'application/json', json.dumps(value).encode('utf-8'))
+
+    def send_text(self, status: int, text: str):
+        self.send_body(status, 'text/plain; charset=utf-8', text.encode('utf-8'))
+
+    def send_body(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # Same as HTTPServer.server_bind, which assumes a TCP address
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def serve(host: str, port: int, unix_socket: Optional[str], workers: int, max_pending: int):
+    pool = WorkerPool(workers)
+
+    DescribeHandler.pool = pool
+    DescribeHandler.slots = threading.BoundedSemaphore(max_pending)
+    DescribeHandler.metrics = Metrics()
+    DescribeHandler.part_count = len(core_parts_bin)
+    DescribeHandler.worker_count = workers
+
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, DescribeHandler)
+        print(f"Listening on {unix_socket}", file=sys.stderr)
+    else:
+        server = ThreadingHTTPServer((host, port), DescribeHandler)
+        print(f"Listening on http://{host}:{server.server_port}", file=sys.stderr)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Serve HTML descriptions of Fritzing sketches')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8357)
+    arg_parser.add_argument('--unix-socket', help='Listen on this Unix socket instead of TCP')
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    arg_parser.add_argument(
+        '--max-pending',
+        type=int,
+        help='Requests beyond this many queued or in progress get a 503 (default: 4 per worker)',
+    )
+    arg_parser.add_argument(
+        '--result-cache',
+        metavar='DIR',
+        help='Reuse descriptions of previously seen sketches stored in this directory',
+    )
+    instrumentation.add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    instrumentation.configure_from_args(args)
+
+    core_parts_bin = load_core_parts(workers=args.workers)
+    if args.result_cache:
+        result_cache = ResultCache(args.result_cache)
+
+    serve(args.host, args.port, args.unix_socket, args.workers, args.max_pending or 4 * args.workers)
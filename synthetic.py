@@ -0,0 +1,299 @@
+# Generates made-up Fritzing sketches and core part files of any size, for benchmarking
+# without a Fritzing install or a collection of real projects. The output is deterministic
+# for a given seed, and covers what the parser handles: core, factory, templated and
+# bundled parts, wires, net labels and grounds. Also generates project pages laid out
+# like the ones on fritzing.org, for the scraper.
+#
+# Usage: python synthetic.py core DIR [--parts N]
+#        python synthetic.py sketch OUT.fzz [--parts N] [--wires M] ...
+import argparse
+import os
+import random
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urljoin
+from xml.sax.saxutils import escape, quoteattr
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from fritzing_parser import GROUND_MODULE_ID, NET_LABEL_MODULE_ID, WIRE_MODULE_ID
+
+# Core parts that every synthetic parts bin has, by file name: the parents of the factory
+# parts the sketches use. (module ID, title, label, properties, pin count)
+FACTORY_PARENTS = [
+    ('ResistorModuleID', '220Ω Resistor', 'R', {'family': 'Resistor', 'resistance': '220'}, 2),
+    ('CapacitorModuleID', 'Ceramic Capacitor', 'C', {'family': 'Ceramic Capacitor', 'capacitance': '100nF'}, 2),
+    ('5mmColorLEDModuleID', 'Red (633nm) LED', 'LED', {'family': 'LED', 'color': 'Red (633nm)'}, 2),
+]
+
+# Templated module IDs with their pin counts; see TEMPLATED_PART_FAMILIES
+TEMPLATED_MODULE_IDS = [
+    ('screw_terminal_2_3.5mm', 2),
+    ('screw_terminal_3_5.0mm', 3),
+    ('generic_ic_dip_8_300mil', 8),
+    ('generic_female_pin_header_4_100mil', 4),
+    ('generic_male_pin_header_6_100mil', 6),
+]
+
+RESISTANCES = ['220', '1k', '4.7k', '10k', '100k']
+CAPACITANCES = ['100nF', '1µF', '10µF']
+
+CORE_PART_PIN_COUNT = 8
+
+
+@dataclass
+class SketchSpec:
+    parts: int = 100
+    wires: int = 200
+    net_labels: int = 10  # Spread over net_labels // 2 net names
+    grounds: int = 5
+    bundled_parts: int = 3  # Custom .fzp files included in the archive
+    core_parts: int = 500  # Must match the parts bin the sketch is parsed against
+    seed: int = 0
+
+
+def core_module_id(i: int) -> str:
+    return f"SyntheticChip{i}ModuleID"
+
+
+def part_file_xml(module_id: str, title: str, label: str, properties: Dict[str, str], pin_count: int) -> str:
+    # Everything but the family is shown in the label, like most real parts
+    show_in_label = ' showInLabel="yes"'
+    props = ''.join(
+        f'<property name={quoteattr(k)}{show_in_label if k != "family" else ""}>{escape(v)}</property>'
+        for k, v in properties.items()
+    )
+    connectors = ''.join(
+        f'<connector id="connector{i}" name="Pin {i + 1}" type="male">'
+        f'<description>Pin {i + 1} of {escape(title)}</description></connector>'
+        for i in range(pin_count)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<module moduleId={quoteattr(module_id)} fritzingVersion="0.9.3b">'
+        f'<title>{escape(title)}</title><label>{escape(label)}</label>'
+        f'<description>A synthetic part for benchmarking</description>'
+        f'<properties>{props}</properties><connectors>{connectors}</connectors></module>'
+    )
+
+
+def write_core_parts(out_dir: str, part_count: int = 500) -> List[str]:
+    """ Writes a parts directory with the factory parents and part_count generic chips; returns the paths """
+    os.makedirs(out_dir, exist_ok=True)
+
+    files = [
+        (f"{module_id}.fzp", part_file_xml(module_id, title, label, props, pin_count))
+        for module_id, title, label, props, pin_count in FACTORY_PARENTS
+    ]
+    files += [
+        (f"synthetic_chip_{i}.fzp", part_file_xml(
+            core_module_id(i), f"Synthetic chip {i}", 'U', {'family': 'Synthetic', 'part number': f"SC{i}"},
+            CORE_PART_PIN_COUNT,
+        ))
+        for i in range(part_count)
+    ]
+
+    paths = []
+    for filename, xml in files:
+        path = os.path.join(out_dir, filename)
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write(xml)
+        paths.append(path)
+
+    return paths
+
+
+def instance_xml(
+    module_id: str,
+    model_index: int,
+    properties: Dict[str, str],
+    connects: Dict[str, List[Tuple[int, str]]],
+    layer: str = 'schematic',
+) -> str:
+    props = ''.join(f'<property name={quoteattr(k)} value={quoteattr(v)}/>' for k, v in properties.items())
+
+    connectors = ''
+    for connector_id, targets in connects.items():
+        targets_xml = ''.join(
+            f'<connect connectorId="{c}" modelIndex="{i}" layer="schematicTrace"/>' for i, c in targets
+        )
+        connectors += (
+            f'<connector connectorId="{connector_id}" layer="{layer}">'
+            f'<geometry x="0" y="0"/><connects>{targets_xml}</connects></connector>'
+        )
+
+    # Real sketches carry breadboard and PCB views too, which the parser has to skip over
+    other_views = ''.join(
+        f'<{view} layer="{view_layer}"><geometry x="0" y="0" z="1.5"/></{view}>'
+        for view, view_layer in [('breadboardView', 'breadboard'), ('pcbView', 'copper0')]
+    )
+
+    return (
+        f'<instance moduleIdRef={quoteattr(module_id)} modelIndex="{model_index}" path=":/synthetic">'
+        f'{props}<title>{escape(module_id)}{model_index}</title><views>{other_views}'
+        f'<schematicView layer="{layer}"><geometry x="0" y="0"/><connectors>{connectors}</connectors>'
+        f'</schematicView></views></instance>'
+    )
+
+
+def write_sketch(path: str, spec: SketchSpec):
+    """ Writes a .fzz archive with a random circuit shaped by spec """
+    rng = random.Random(spec.seed)
+    bundled = [
+        (f"SyntheticCustom{spec.seed}_{i}ModuleID", rng.randint(2, 12)) for i in range(spec.bundled_parts)
+    ]
+
+    # (model index, module ID, properties, pin count)
+    parts: List[Tuple[int, str, Dict[str, str], int]] = []
+    next_index = 1000
+    for _ in range(spec.parts):
+        kind = rng.random()
+        if kind < 0.4:
+            module_id, _, _, _, pin_count = rng.choice(FACTORY_PARENTS)
+            if module_id == 'ResistorModuleID':
+                props = {'resistance': rng.choice(RESISTANCES)}
+            elif module_id == 'CapacitorModuleID':
+                props = {'capacitance': rng.choice(CAPACITANCES)}
+            else:
+                props = {}
+        elif kind < 0.5:
+            (module_id, pin_count), props = rng.choice(TEMPLATED_MODULE_IDS), {}
+        elif kind < 0.6 and bundled:
+            (module_id, pin_count), props = rng.choice(bundled), {}
+        else:
+            module_id, pin_count, props = core_module_id(rng.randrange(spec.core_parts)), CORE_PART_PIN_COUNT, {}
+
+        parts.append((next_index, module_id, props, pin_count))
+        next_index += 1
+
+    connects: Dict[int, Dict[str, List[Tuple[int, str]]]] = {index: {} for index, _, _, _ in parts}
+    # Wires, net labels and grounds: (model index, module ID, properties, connects)
+    connectors: List[Tuple[int, str, Dict[str, str], Dict[str, List[Tuple[int, str]]]]] = []
+
+    def random_pin() -> Tuple[int, str]:
+        index, _, _, pin_count = rng.choice(parts)
+        return index, f"connector{rng.randrange(pin_count)}"
+
+    def attach(index: int, connector_id: str) -> Tuple[int, str]:
+        """ Connects a pin of a random part to the given connector, returning the part's pin """
+        part_index, pin_id = random_pin()
+        connects[part_index].setdefault(pin_id, []).append((index, connector_id))
+        return part_index, pin_id
+
+    if parts:
+        for _ in range(spec.wires):
+            index, next_index = next_index, next_index + 1
+            connectors.append((index, WIRE_MODULE_ID, {}, {
+                'connector0': [attach(index, 'connector0')],
+                'connector1': [attach(index, 'connector1')],
+            }))
+
+        for i in range(spec.net_labels):
+            index, next_index = next_index, next_index + 1
+            net_name = f"NET{i % max(1, spec.net_labels // 2)}"
+            connectors.append((index, NET_LABEL_MODULE_ID, {'label': net_name}, {
+                'connector0': [attach(index, 'connector0')],
+            }))
+
+        for _ in range(spec.grounds):
+            index, next_index = next_index, next_index + 1
+            connectors.append((index, GROUND_MODULE_ID, {}, {'connector0': [attach(index, 'connector0')]}))
+
+    instances = [instance_xml(module_id, index, props, connects[index]) for index, module_id, props, _ in parts]
+    instances += [
+        instance_xml(module_id, index, props, conns, layer='schematicTrace' if module_id == WIRE_MODULE_ID else 'schematic')
+        for index, module_id, props, conns in connectors
+    ]
+
+    fz = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<module fritzingVersion="0.9.3b"><views/><instances>' + ''.join(instances) + '</instances></module>'
+    )
+
+    with ZipFile(path, 'w', compression=ZIP_DEFLATED) as zf:
+        zf.writestr(os.path.splitext(os.path.basename(path))[0] + '.fz', fz)
+        for module_id, pin_count in bundled:
+            zf.writestr(
+                f"part.{module_id}.fzp",
+                part_file_xml(module_id, f"Custom part {module_id}", 'X', {'family': 'Custom', 'voltage': '5'}, pin_count),
+            )
+
+
+def project_page_html(base_url: str, index: int) -> Tuple[str, Dict[str, Any]]:
+    """
+    Returns a project page laid out like the real ones, and the listing the scraper should
+    get out of it (as a dict of ProjectListing fields) if it's served at base_url.
+    """
+    rng = random.Random(index)
+    slug = f"synthetic-project-{index}"
+    title = f"Synthetic project {index}"
+    tagline = f"Blinks {rng.randint(1, 64)} LEDs"
+    creator = f"maker{rng.randrange(1000)}"
+    license_url = 'https://creativecommons.org/licenses/by-sa/3.0/'
+    description_html = ''.join(f"<p>Step {i + 1}: solder part {rng.randrange(100)}.</p>" for i in range(rng.randint(1, 5)))
+    images = [f"/media/projects/{slug}/image{i}.jpg" for i in range(rng.randint(0, 4))]
+    downloads = [f"{slug}.fzz"] + [f"{slug}-{i}.ino" for i in range(rng.randint(0, 2))]
+
+    gallery = ''.join(f'<li><a href="{src}"><img src="{src}"></a></li>' for src in images)
+    download_items = ''.join(f'<li><a href="/media/fritzing-repo/projects/{name}">{name}</a></li>' for name in downloads)
+    page = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{escape(title)}</title></head><body>
+<div id="content">
+<div class="row"><div class="col-md-12"><h1>{escape(title)}</h1><p class="lead">{escape(tagline)}</p></div></div>
+<div class="row"><div class="col-md-12"><ul class="thumb-gallery">{gallery}</ul></div></div>
+<div class="row"><div class="col-md-12 meta"><h3><a href="/users/{creator}">{creator}</a></h3>
+<p class="license"><a href="{license_url}">CC BY-SA 3.0</a></p></div></div>
+<div class="row"><div class="col-md-8">{description_html}</div>
+<div class="col-md-4 highlight"><h4>Downloads</h4><ul>{download_items}</ul></div></div>
+</div></body></html>"""
+
+    url = urljoin(base_url, f"/projects/{slug}")
+    expected = {
+        'url': url,
+        'title': title,
+        'tagline': tagline,
+        'description_html': description_html,
+        'creator': creator,
+        'license_url': license_url,
+        'image_urls': [urljoin(url, src) for src in images],
+        'download_urls': {name: urljoin(url, f"/media/fritzing-repo/projects/{name}") for name in downloads},
+    }
+    return page, expected
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Generate synthetic Fritzing files for benchmarking')
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+
+    core_parser = subparsers.add_parser('core', help='Write a synthetic core parts directory')
+    core_parser.add_argument('out_dir')
+    core_parser.add_argument('--parts', type=int, default=SketchSpec.core_parts)
+
+    sketch_parser = subparsers.add_parser('sketch', help='Write a synthetic .fzz sketch')
+    sketch_parser.add_argument('out')
+    sketch_parser.add_argument('--parts', type=int, default=SketchSpec.parts)
+    sketch_parser.add_argument('--wires', type=int, default=SketchSpec.wires)
+    sketch_parser.add_argument('--net-labels', type=int, default=SketchSpec.net_labels)
+    sketch_parser.add_argument('--grounds', type=int, default=SketchSpec.grounds)
+    sketch_parser.add_argument('--bundled-parts', type=int, default=SketchSpec.bundled_parts)
+    sketch_parser.add_argument(
+        '--core-parts',
+        type=int,
+        default=SketchSpec.core_parts,
+        help='Number of parts in the synthetic core parts directory to draw from',
+    )
+    sketch_parser.add_argument('--seed', type=int, default=SketchSpec.seed)
+
+    args = arg_parser.parse_args()
+
+    if args.command == 'core':
+        write_core_parts(args.out_dir, args.parts)
+    else:
+        write_sketch(args.out, SketchSpec(
+            parts=args.parts,
+            wires=args.wires,
+            net_labels=args.net_labels,
+            grounds=args.grounds,
+            bundled_parts=args.bundled_parts,
+            core_parts=args.core_parts,
+            seed=args.seed,
+        ))
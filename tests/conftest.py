@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repo rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fritzing_parser import PartsBin, load_core_parts  # noqa: E402
+from synthetic import SketchSpec, write_core_parts, write_sketch  # noqa: E402
+
+CORE_PARTS = 100
+
+
+@pytest.fixture(scope='session')
+def core_parts_bin(tmp_path_factory) -> PartsBin:
+    """ A bin of synthetic core parts, so the tests don't need Fritzing installed """
+    core_dir = str(tmp_path_factory.mktemp('core'))
+    write_core_parts(core_dir, CORE_PARTS)
+    return load_core_parts(cache_path=None, dirs=[core_dir])
+
+
+@pytest.fixture
+def make_sketch(tmp_path):
+    """ Writes a synthetic sketch against core_parts_bin and returns its path """
+    def make(parts: int, seed: int = 0, **kwargs) -> str:
+        spec = SketchSpec(
+            parts=parts,
+            wires=2 * parts,
+            net_labels=max(2, parts // 10),
+            grounds=max(1, parts // 20),
+            core_parts=CORE_PARTS,
+            seed=seed,
+            **kwargs,
+        )
+        path = str(tmp_path / f"synthetic_{parts}_{seed}.fzz")
+        write_sketch(path, spec)
+        return path
+
+    return make
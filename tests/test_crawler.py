@@ -0,0 +1,92 @@
+import hashlib
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from crawler import FETCHES_AHEAD_PER_WORKER, CrawlStats, CrawlStore, crawl
+from http_client import HttpResponse
+from scraper import PROJECT_LIST_URL
+from synthetic import project_page_html
+
+BASE_URL = 'https://fritzing.org'
+
+
+def site(projects: int) -> Dict[str, bytes]:
+    """ One page of the project list linking to that many project pages """
+    pages = {}
+    links = []
+    for i in range(projects):
+        page, listing = project_page_html(BASE_URL, i)
+        pages[listing['url']] = page.encode()
+        links.append(f'<a href="{listing["url"][len(BASE_URL):]}">{i}</a>')
+
+    pages[PROJECT_LIST_URL.format(page=1)] = f"<html><body>{''.join(links)}</body></html>".encode()
+    return pages
+
+
+class FakeClient:
+    """
+    Serves pages from a dict. Conditional requests get a 304 without any validators, which
+    is allowed and which some servers do.
+    """
+
+    def __init__(self, pages: Dict[str, bytes], delay_s: float = 0.0):
+        self.pages = pages
+        self.delay_s = delay_s
+        self.requests: List[Tuple[str, Dict[str, str]]] = []
+        self._lock = threading.Lock()
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> HttpResponse:
+        with self._lock:
+            self.requests.append((url, dict(headers or {})))
+        time.sleep(self.delay_s)
+
+        body = self.pages.get(url)
+        if body is None:
+            return HttpResponse(url=url, status=404, headers={}, body=b'')
+
+        etag = '"' + hashlib.sha256(body).hexdigest() + '"'
+        if (headers or {}).get('If-None-Match') == etag:
+            return HttpResponse(url=url, status=304, headers={}, body=b'')
+        return HttpResponse(url=url, status=200, headers={'etag': etag}, body=body)
+
+
+def test_not_modified_list_page_keeps_validators(tmp_path):
+    client = FakeClient(site(3))
+    store = CrawlStore(str(tmp_path / 'state.sqlite'))
+
+    crawls = []
+    for _ in range(3):
+        stats = CrawlStats()
+        for listing in crawl(store, client, stats=stats):
+            store.mark_processed(listing)
+        crawls.append(stats)
+
+    assert crawls[0].list_pages_fetched == 1
+    for stats in crawls[1:]:
+        assert stats.list_pages_fetched == 0
+        assert stats.list_pages_not_modified == 1
+        assert stats.projects_not_modified == 3
+
+
+def test_closing_early_stops_fetching(tmp_path):
+    workers = 2
+    client = FakeClient(site(40), delay_s=0.01)
+    store = CrawlStore(str(tmp_path / 'state.sqlite'))
+    project_urls = lambda: [url for url, _ in client.requests if '?page=' not in url]
+
+    listings = crawl(store, client, workers=workers)
+    first = next(listings)
+    store.mark_processed(first)
+
+    start = time.perf_counter()
+    listings.close()
+    assert time.perf_counter() - start < 0.5
+
+    time.sleep(0.1)  # For the fetches already running to finish
+    assert len(project_urls()) <= FETCHES_AHEAD_PER_WORKER * workers
+
+    # The next crawl carries on with the rest
+    rest = [listing.url for listing in crawl(store, client, workers=workers)]
+    assert first.url not in rest
+    assert len(rest) == 39
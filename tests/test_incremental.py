@@ -0,0 +1,130 @@
+import re
+from typing import Callable, Optional
+from zipfile import ZipFile
+
+import pytest
+
+from describer import describe_as_html
+from fritzing_parser import parse_sketch
+from incremental import IncrementalDescriber
+
+
+def edit_archive(
+    src: str,
+    dst: str,
+    fz: Optional[Callable[[str], str]] = None,
+    fzp: Optional[Callable[[str], str]] = None,
+):
+    """ Copies a sketch archive, passing the .fz and .fzp files through the given edits """
+    with ZipFile(src, 'r') as zin, ZipFile(dst, 'w') as zout:
+        for name in zin.namelist():
+            data = zin.read(name).decode('utf-8')
+            if fz is not None and name.endswith('.fz'):
+                data = fz(data)
+            elif fzp is not None and name.endswith('.fzp'):
+                data = fzp(data)
+            zout.writestr(name, data)
+
+
+def rename_pin(fzp: str) -> str:
+    return fzp.replace('name="Pin 1"', 'name="VCC"').replace('>Pin 2 of ', '>Supply input of ')
+
+
+def remove_first_instance(module_id: str) -> Callable[[str], str]:
+    """ Deletes an instance along with the other instances' connections to it, like Fritzing does """
+    def edit(fz: str) -> str:
+        instance = re.search(rf'<instance moduleIdRef="{module_id}" modelIndex="(\d+)".*?</instance>', fz, re.DOTALL)
+        fz = fz.replace(instance.group(0), '', 1)
+        return re.sub(rf'<connect [^>]*modelIndex="{instance.group(1)}"[^>]*/>', '', fz)
+
+    return edit
+
+
+def disconnect_first_instance(fz: str) -> str:
+    """ Removes every connection to and from the first instance """
+    instance = re.search(r'<instance [^>]*modelIndex="(\d+)".*?</instance>', fz, re.DOTALL)
+    fz = fz.replace(instance.group(0), re.sub(r'<connect [^>]*/>', '', instance.group(0)), 1)
+    return re.sub(rf'<connect [^>]*modelIndex="{instance.group(1)}"[^>]*/>', '', fz)
+
+
+def swap_first_instances(fz: str) -> str:
+    """ Moves the second instance before the first, which renumbers designators """
+    instances = re.findall(r'<instance .*?</instance>', fz, re.DOTALL)
+    first, second = instances[0], instances[1]
+    return fz.replace(first + second, second + first, 1)
+
+
+FZ_EDITS = {
+    'property': lambda fz: re.sub(r'name="resistance" value="[^"]*"', 'name="resistance" value="2.2M"', fz),
+    # These two don't change the description
+    'breadboard_move': lambda fz: fz.replace('<geometry x="0" y="0" z="1.5"/>', '<geometry x="9" y="0" z="1.5"/>', 1),
+    'disconnect_one_side': lambda fz: re.sub(r'<connect [^>]*/>', '', fz, count=1),
+    'disconnect': disconnect_first_instance,
+    'remove_wire': remove_first_instance('WireModuleID'),
+    'remove_part': remove_first_instance('CapacitorModuleID'),
+    'reorder': swap_first_instances,
+}
+
+
+@pytest.fixture
+def sketch(make_sketch) -> str:
+    return make_sketch(60, bundled_parts=3)
+
+
+def test_bundled_part_edit(core_parts_bin, sketch, tmp_path):
+    edited = str(tmp_path / 'edited.fzz')
+    edit_archive(sketch, edited, fzp=rename_pin)
+
+    describer = IncrementalDescriber(core_parts_bin)
+    before = describer.update(sketch)
+    after = describer.update(edited)
+
+    assert after != before
+    assert 'Supply input of ' in after
+    assert after == describe_as_html(parse_sketch(core_parts_bin, edited))
+
+
+@pytest.mark.parametrize('edit', FZ_EDITS.keys())
+def test_edit_matches_full_describe(core_parts_bin, sketch, tmp_path, edit):
+    edited = str(tmp_path / 'edited.fzz')
+    edit_archive(sketch, edited, fz=FZ_EDITS[edit])
+
+    describer = IncrementalDescriber(core_parts_bin)
+    describer.update(sketch)
+
+    # And back again, to check nothing from the edit is left over
+    assert describer.update(edited) == describe_as_html(parse_sketch(core_parts_bin, edited))
+    assert describer.update(sketch) == describe_as_html(parse_sketch(core_parts_bin, sketch))
+
+
+def test_failed_update_is_not_reused(core_parts_bin, sketch, tmp_path):
+    broken = str(tmp_path / 'broken.fzz')
+    edit_archive(sketch, broken, fz=lambda fz: fz.replace('moduleIdRef="CapacitorModuleID"', 'moduleIdRef="NoSuchModuleID"', 1))
+
+    # Both on a fresh describer and after a good version
+    for previous in (None, sketch):
+        describer = IncrementalDescriber(core_parts_bin)
+        if previous is not None:
+            describer.update(previous)
+
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match='NoSuchModuleID'):
+                describer.update(broken)
+
+    assert describer.update(sketch) == describe_as_html(parse_sketch(core_parts_bin, sketch))
+
+
+def test_unchanged_saves_are_reused(core_parts_bin, sketch, tmp_path):
+    moved = str(tmp_path / 'moved.fzz')
+    edit_archive(sketch, moved, fz=FZ_EDITS['breadboard_move'])
+
+    describer = IncrementalDescriber(core_parts_bin)
+    html = describer.update(sketch)
+    assert not describer.last_update.reused
+
+    assert describer.update(sketch) == html
+    assert describer.last_update.reused
+
+    assert describer.update(moved) == html
+    assert describer.last_update.reused
+    assert describer.last_update.changed == 0
@@ -0,0 +1,69 @@
+from collections import defaultdict
+from typing import List, Set, Tuple
+
+from benchmark import net_adjacencies, quadratic_build_nets, random_adjacencies, read_sketch
+from fritzing_parser import PinRef, build_nets
+
+
+def search_build_nets(adjacencies: Set[Tuple[PinRef, PinRef]]) -> List[List[PinRef]]:
+    """ Connected components by depth first search; fast enough for big sketches """
+    neighbours = defaultdict(set)
+    for a, b in adjacencies:
+        neighbours[a].add(b)
+        neighbours[b].add(a)
+
+    seen = set()
+    nets = []
+    for start in neighbours:
+        if start in seen:
+            continue
+        seen.add(start)
+        net, stack = [], [start]
+        while stack:
+            pin = stack.pop()
+            net.append(pin)
+            for other in neighbours[pin] - seen:
+                seen.add(other)
+                stack.append(other)
+        nets.append(sorted(net))
+
+    return sorted(nets)
+
+
+def sketch_adjacencies(core_parts_bin, path: str) -> Set[Tuple[PinRef, PinRef]]:
+    sketch_bin, records = read_sketch(core_parts_bin, path)
+    return net_adjacencies(sketch_bin, records)
+
+
+def test_matches_quadratic_reference(core_parts_bin, make_sketch):
+    adjacencies = sketch_adjacencies(core_parts_bin, make_sketch(500))
+    assert len(adjacencies) > 2000
+
+    assert build_nets(adjacencies) == quadratic_build_nets(adjacencies)
+
+
+def test_matches_search_on_big_sketch(core_parts_bin, make_sketch):
+    adjacencies = sketch_adjacencies(core_parts_bin, make_sketch(5000, seed=1))
+    assert len(adjacencies) > 20000
+
+    assert build_nets(adjacencies) == search_build_nets(adjacencies)
+
+
+def test_random_adjacencies():
+    for seed in range(5):
+        adjacencies = random_adjacencies(300, seed)
+        assert build_nets(adjacencies) == quadratic_build_nets(adjacencies)
+
+
+def test_nets_are_disjoint_and_ordered():
+    adjacencies = random_adjacencies(5000)
+    nets = build_nets(adjacencies)
+
+    pins = [p for net in nets for p in net]
+    assert len(pins) == len(set(pins)) == len({p for adj in adjacencies for p in adj})
+    assert all(net == sorted(net) for net in nets)
+    assert nets == sorted(nets)
+
+
+def test_no_adjacencies():
+    assert build_nets(set()) == []
@@ -0,0 +1,55 @@
+import pytest
+
+from benchmark import SAMPLE_MODULE_IDS, LinearSuffixMatcher
+from fritzing_parser import (
+    FACTORY_PART_LONG_DESCRIPTION_OVERRIDES,
+    FACTORY_PART_MODULE_ID_SUFFIXES,
+    FACTORY_PART_TITLE_OVERRIDES,
+    SuffixMatcher,
+)
+
+MATCHERS = {
+    'factory_parts': FACTORY_PART_MODULE_ID_SUFFIXES,
+    'title_overrides': FACTORY_PART_TITLE_OVERRIDES,
+    'description_overrides': FACTORY_PART_LONG_DESCRIPTION_OVERRIDES,
+}
+
+
+def module_ids_near(keys):
+    """ Each key as a module ID, plus IDs that only nearly match it """
+    for k in keys:
+        k = k.lstrip('^')
+        yield from [k, 'Prefixed' + k, k[1:], k + 'x', k.lower()]
+
+
+@pytest.mark.parametrize('name', MATCHERS.keys())
+def test_matches_linear_reference(name):
+    matcher = MATCHERS[name]
+    elems = dict(matcher.items())
+    reference = LinearSuffixMatcher(elems)
+
+    module_ids = SAMPLE_MODULE_IDS + list(module_ids_near(elems.keys())) + ['', 'x']
+    for m in module_ids:
+        assert SuffixMatcher(elems).lookup(m, None) == reference.lookup(m, None), m
+        # And again through the shared matcher's memo
+        assert matcher.lookup(m, None) == reference.lookup(m, None), m
+
+
+def test_longest_suffix_and_exact_keys():
+    matcher = SuffixMatcher({'Resistor': 1, 'BigResistor': 2, '^Resistor': 3, '^Exact': 4})
+
+    assert matcher.lookup('Resistor', 0) == 3
+    assert matcher.lookup('ABigResistor', 0) == 2
+    assert matcher.lookup('SmallResistor', 0) == 1
+    assert matcher.lookup('Exact', 0) == 4
+    assert matcher.lookup('NotExact', 0) == 0
+    assert matcher.lookup('Capacitor', 0) == 0
+
+
+def test_memo_is_bounded():
+    matcher = SuffixMatcher({'Resistor': 1})
+    for i in range(3 * SuffixMatcher.MAX_MEMO_SIZE):
+        assert matcher.lookup(f"Upload{i}Resistor", 0) == 1
+        assert matcher.lookup(f"Upload{i}", 0) == 0
+
+    assert len(matcher._memo) <= SuffixMatcher.MAX_MEMO_SIZE
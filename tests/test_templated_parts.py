@@ -0,0 +1,62 @@
+import pytest
+
+from benchmark import loop_templated_lookup
+from fritzing_parser import (
+    TEMPLATED_PART_FAMILIES,
+    TEMPLATED_PARTS,
+    InstanceRecord,
+    TemplatedPartMatcher,
+    build_schematic,
+)
+
+MODULE_IDS = [
+    'screw_terminal_2_3.5mm',
+    'screw_terminal_12_5.0mm',
+    'generic_ic_dip_8_300mil',
+    'generic_ic_dip_40_600mil',
+    'generic_female_pin_header_4_100mil',
+    'generic_male_pin_header_6_100mil',
+    'generic_dual_row_male_pin_header_20_100mil',
+    'generic_molex_pin_header_3',
+    'generic_shrouded_pin_header_10',
+    # None of these should match
+    'SparkFun-Connectors-USB-B-SMT',
+    'screw_terminal_x_3.5mm',
+    'generic_ic_sip_8_300mil',
+    'my_generic_ic_dip_8_300mil',
+    '',
+]
+
+
+@pytest.mark.parametrize('module_id', MODULE_IDS)
+def test_matches_loop_reference(module_id):
+    expected = loop_templated_lookup(module_id)
+
+    assert TemplatedPartMatcher(TEMPLATED_PART_FAMILIES).lookup(module_id) == expected
+    assert TEMPLATED_PARTS.lookup(module_id) == expected  # Memoized
+
+
+def test_captures_properties():
+    family, props = TEMPLATED_PARTS.lookup('screw_terminal_3_5.0mm')
+
+    assert family.title == 'Screw terminal'
+    assert props == {'pins': '3', 'pin spacing': '5.0mm'}
+
+
+def test_memo_is_bounded():
+    matcher = TemplatedPartMatcher(TEMPLATED_PART_FAMILIES)
+    for i in range(3 * TemplatedPartMatcher.MAX_MEMO_SIZE):
+        assert matcher.lookup(f"generic_molex_pin_header_{i}") is not None
+
+    assert len(matcher._memo) <= TemplatedPartMatcher.MAX_MEMO_SIZE
+
+
+def test_unknown_part_after_templated_part(core_parts_bin):
+    # An unknown part used to silently get the previous instance's part
+    records = [
+        InstanceRecord('1', 'screw_terminal_2_3.5mm', True, {}, [], True),
+        InstanceRecord('2', 'NoSuchPartModuleID', True, {}, [], True),
+    ]
+
+    with pytest.raises(RuntimeError, match='NoSuchPartModuleID'):
+        build_schematic(core_parts_bin.overlay(), records)